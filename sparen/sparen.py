@@ -3,13 +3,674 @@
 from __future__ import print_function
 from inspect import stack, getframeinfo
 import os
+import re
 import sys
+import math
+import json
+import struct
+import zlib
+import gzip
 import time
 import datetime
 import inspect
 import functools
+import itertools
+import queue
+import atexit
+import socket
+import asyncio
+import multiprocessing
+import linecache
+import threading
+import weakref
 import traceback
 
+# Not every build includes lzma
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Optional, used for vectorized plotting
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Fast frame access, not every interpreter provides this
+_getframe = getattr(sys, '_getframe', None)
+
+# Log levels
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARN: 'WARN', ERROR: 'ERROR'}
+LEVEL_VALUES = {'DEBUG': DEBUG, 'INFO': INFO, 'WARN': WARN, 'WARNING': WARN, 'ERROR': ERROR}
+
+
+class Lazy:
+
+    ''' Defers rendering of a log argument until the line is written
+
+        @param [in] fn      - Callable returning the value, or a % format string
+        @param [in] args    - Arguments for the callable or format string
+
+        Example:
+        @begincode
+
+            # Neither runs unless debug output is enabled
+            log.debug(Lazy(expensiveReport))
+            log.debug(Lazy("%d items in %s", len(items), name))
+
+        @endcode
+    '''
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    ''' Renders the value
+    '''
+    def __str__(self):
+        if callable(self.fn):
+            return str(self.fn(*self.args))
+        if self.args:
+            return str(self.fn) % self.args
+        return str(self.fn)
+
+
+class LogFile:
+
+    ''' Constructor
+        @param [in] fname       - Log file name
+        @param [in] bufsize     - Write buffer size in bytes
+        @param [in] maxsize     - Rotate the file once it grows beyond this
+                                  many bytes, zero to disable
+        @param [in] maxage      - Rotate the file once it has been open this
+                                  many seconds, zero to disable
+        @param [in] backups     - Number of rotated files to keep,
+                                    fname.1 is the most recent
+        @param [in] binary      - True to write bytes rather than text
+    '''
+    def __init__(self, fname, bufsize=65536, maxsize=0, maxage=0, backups=5, binary=False):
+        self.fname = fname
+        self.binary = binary
+        self.bufsize = bufsize
+        self.maxsize = maxsize
+        self.maxage = maxage
+        self.backups = backups
+        self.f = None
+        self.size = 0
+        self.opened = 0
+
+    ''' Destructor
+    '''
+    def __del__(self):
+        self.close()
+
+    ''' Opens the file for appending if it is not already open
+    '''
+    def open(self):
+        if self.f:
+            return True
+        if self.binary:
+            self.f = open(self.fname, 'ab', buffering=self.bufsize)
+        else:
+            self.f = open(self.fname, 'a', buffering=self.bufsize, encoding='utf-8')
+        self.size = self.f.tell()
+        self.opened = time.time()
+        return True
+
+    ''' Writes to the file, rotating first if needed
+        @param [in] s   - String to write, or bytes for a binary file
+    '''
+    def write(self, s):
+        # Sizes are in bytes, text is written as utf-8
+        n = len(s) if self.binary or s.isascii() else len(s.encode('utf-8'))
+        if not self.f:
+            self.open()
+        elif (self.maxsize and self.size + n > self.maxsize and 0 < self.size) \
+                or (self.maxage and time.time() - self.opened >= self.maxage):
+            self.rotate()
+        self.f.write(s)
+        self.size += n
+
+    ''' Flushes buffered data to disk
+    '''
+    def flush(self):
+        if self.f:
+            self.f.flush()
+
+    ''' Flushes and closes the file
+    '''
+    def close(self):
+        if self.f:
+            try:
+                self.f.close()
+            finally:
+                self.f = None
+
+    ''' Closes the current file, shifts the backups and starts a new file
+
+            fname -> fname.1 -> fname.2 -> ... -> fname.<backups>
+    '''
+    def rotate(self):
+        self.close()
+        if 0 < self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                src = "%s.%d" % (self.fname, i)
+                if os.path.exists(src):
+                    os.replace(src, "%s.%d" % (self.fname, i + 1))
+            if os.path.exists(self.fname):
+                os.replace(self.fname, self.fname + '.1')
+        elif os.path.exists(self.fname):
+            os.remove(self.fname)
+        self.open()
+
+
+class CompressedLogFile(LogFile):
+
+    ''' Constructor
+
+        Streams the log through a compressor, see LogFile.  Each block
+        flush makes everything written so far readable, so fewer flushes
+        give better compression.  Size limits apply to the compressed file.
+
+        @param [in] fname       - Log file name
+        @param [in] codec       - 'gzip' or 'xz'
+        @param [in] level       - Compression level, 0 - 9
+        @param [in] interval    - Seconds between block flushes,
+                                  zero to only flush on request
+        @param [in] bufsize     - Write buffer size in bytes
+        @param [in] maxsize     - Start a new segment once the compressed file
+                                  grows beyond this many bytes, zero to disable
+        @param [in] maxage      - Start a new segment once the file has been
+                                  open this many seconds, zero to disable
+        @param [in] backups     - Number of old segments to keep,
+                                    fname.1 is the most recent
+        @param [in] binary      - True to write bytes rather than text
+    '''
+    def __init__(self, fname, codec='gzip', level=6, interval=1.0, bufsize=65536, maxsize=0, maxage=0, backups=5, binary=False):
+        self.f = None
+        if codec not in ('gzip', 'xz'):
+            raise ValueError("Invalid compression codec: %s" % codec)
+        if 'xz' == codec and not lzma:
+            raise ValueError("lzma is not available")
+        super().__init__(fname, bufsize=bufsize, maxsize=maxsize, maxage=maxage, backups=backups, binary=binary)
+        self.codec = codec
+        self.level = level
+        self.interval = interval
+        self.z = None
+        self.flushed = 0
+
+    ''' Returns a new compressor for the codec
+    '''
+    def _compressor(self):
+        if 'gzip' == self.codec:
+            return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return lzma.LZMACompressor(preset=self.level)
+
+    ''' Opens the file for appending, each open starts a new stream
+    '''
+    def open(self):
+        if self.f:
+            return True
+        self.f = open(self.fname, 'ab', buffering=self.bufsize)
+        self.size = self.f.tell()
+        self.opened = self.flushed = time.time()
+        self.z = self._compressor()
+        return True
+
+    ''' Compresses and writes, rotating first if needed
+        @param [in] s   - String to write, or bytes for a binary file
+    '''
+    def write(self, s):
+        if not self.f:
+            self.open()
+        elif (self.maxsize and self.size >= self.maxsize) \
+                or (self.maxage and time.time() - self.opened >= self.maxage):
+            self.rotate()
+        b = self.z.compress(s if self.binary else s.encode('utf-8'))
+        if b:
+            self.f.write(b)
+            self.size += len(b)
+        if self.interval and time.time() - self.flushed >= self.interval:
+            self.flush()
+
+    ''' Ends the current compressed block and flushes it to disk
+
+            gzip    - Sync flush, the stream continues
+            xz      - The stream is finished and a new one started
+    '''
+    def flush(self):
+        if not self.f:
+            return
+        if 'gzip' == self.codec:
+            b = self.z.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            b = self.z.flush()
+            self.z = self._compressor()
+        self.f.write(b)
+        self.size += len(b)
+        self.f.flush()
+        self.flushed = time.time()
+
+    ''' Finishes the stream and closes the file
+    '''
+    def close(self):
+        if self.f:
+            try:
+                self.f.write(self.z.flush())
+                self.f.close()
+            finally:
+                self.f = None
+                self.z = None
+
+
+''' Opens a log file for reading, compressed files are detected
+    @param [in] fname   - Log file name
+    @param [in] binary  - True to read bytes rather than text
+
+    @returns File object
+'''
+def openLogFile(fname, binary=False):
+
+    with open(fname, 'rb') as f:
+        magic = f.read(6)
+
+    mode = 'rb' if binary else 'rt'
+    enc = None if binary else 'utf-8'
+    if magic.startswith(b'\x1f\x8b'):
+        return gzip.open(fname, mode, encoding=enc)
+    if magic.startswith(b'\xfd7zXZ\x00') and lzma:
+        return lzma.open(fname, mode, encoding=enc)
+    return open(fname, mode, encoding=enc)
+
+''' Lists a log file and its rotated segments
+    @param [in] fname   - Log file name
+
+    @returns File names, oldest first
+'''
+def getLogSegments(fname):
+
+    i = 1
+    while os.path.exists("%s.%d" % (fname, i)):
+        i += 1
+    return ["%s.%d" % (fname, k) for k in range(i - 1, 0, -1)] + ([fname] if os.path.exists(fname) else [])
+
+''' Reads the lines of a log file, plain or compressed
+    @param [in] fname       - Log file name
+    @param [in] segments    - True to read the rotated segments first
+
+    @returns Generator of lines
+'''
+def readLogLines(fname, segments=False):
+
+    for fn in getLogSegments(fname) if segments else [fname]:
+        with openLogFile(fn) as f:
+            try:
+                for line in f:
+                    yield line
+            except EOFError:
+                # Stream still being written
+                pass
+
+
+''' Binary record header
+        length, timestamp, level, line
+'''
+BINARY_HEADER = struct.Struct('<IdBI')
+BINARY_LENGTH = struct.Struct('<I')
+
+''' Encodes a structured log record
+    @param [in] r       - Record dictionary, see Logging.setLogFile()
+    @param [in] fmt     - 'json' for a JSON line or 'binary'
+
+    @returns A string for json, bytes for binary
+'''
+def encodeLogRecord(r, fmt='json'):
+
+    if 'json' == fmt:
+        return json.dumps(r, separators=(',', ':'), ensure_ascii=False, default=str) + '\n'
+
+    body = b''
+    for k in ('file', 'function', 'message'):
+        b = str(r.get(k, '')).encode('utf-8')
+        body += BINARY_LENGTH.pack(len(b)) + b
+    b = json.dumps(r['exception'], separators=(',', ':'), default=str).encode('utf-8') if r.get('exception') else b''
+    body += BINARY_LENGTH.pack(len(b)) + b
+
+    lv = LEVEL_VALUES.get(r.get('level'), INFO)
+    return BINARY_HEADER.pack(BINARY_HEADER.size - BINARY_LENGTH.size + len(body), r['ts'], lv, r.get('line', 0)) + body
+
+''' Reads structured log records written by Logging
+    @param [in] fname   - Log file name, plain or compressed
+    @param [in] fmt     - 'json' or 'binary'
+
+    @returns Generator of record dictionaries
+'''
+def readLogRecords(fname, fmt='json'):
+
+    if 'json' == fmt:
+        for line in readLogLines(fname):
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    def read(f, n):
+        try:
+            return f.read(n)
+        except EOFError:
+            return b''
+
+    with openLogFile(fname, binary=True) as f:
+        while True:
+            b = read(f, BINARY_LENGTH.size)
+            if len(b) < BINARY_LENGTH.size:
+                break
+            n = BINARY_LENGTH.unpack(b)[0]
+            b = b + read(f, n)
+            if len(b) < BINARY_LENGTH.size + n:
+                break
+            n, ts, lv, line = BINARY_HEADER.unpack_from(b)
+            i = BINARY_HEADER.size
+            v = []
+            for k in range(0, 4):
+                sz = BINARY_LENGTH.unpack_from(b, i)[0]
+                i += BINARY_LENGTH.size
+                v.append(b[i:i+sz].decode('utf-8'))
+                i += sz
+            r = {'ts': ts, 'level': LEVEL_NAMES.get(lv, '?'), 'file': v[0], 'line': line, 'function': v[1], 'message': v[2]}
+            if v[3]:
+                r['exception'] = json.loads(v[3])
+            yield r
+
+
+class LogSink:
+
+    ''' Constructor
+
+        Base class for log outputs.  Each line is rendered once per format
+        and the result is shared by every sink using that format.
+
+        @param [in] level   - Minimum level written to this sink
+        @param [in] fmt     - Output format
+                                'color'     = Console text with colors
+                                'text'      = Plain text lines
+                                'json'      = One compact JSON object per line
+                                'binary'    = Length prefixed binary records
+                                callable    = Function taking the structured
+                                              record and returning a string,
+                                              the record also has 'prefix'
+        @param [in] context - True to receive the lines dumped from the
+                              ring buffer, see Logging.setRingBuffer()
+    '''
+    def __init__(self, level=DEBUG, fmt='text', context=True):
+        self.level = level
+        self.fmt = fmt
+        self.context = context
+        self.console = False
+        # True if the sink flushes on its own schedule, only flush()
+        # reaches it, not the flushes after each batch or error line
+        self.lazy = False
+
+    ''' Writes one formatted line
+        @param [in] out     - Output of this sink's format
+    '''
+    def write(self, out):
+        pass
+
+    ''' Flushes any buffered output
+    '''
+    def flush(self):
+        pass
+
+    ''' Flushes and releases the output
+    '''
+    def close(self):
+        pass
+
+
+class NullSink(LogSink):
+
+    ''' Constructor
+
+        Discards everything
+
+        @param [in] level   - Minimum level written to this sink
+    '''
+    def __init__(self, level=DEBUG):
+        super().__init__(level=level, fmt='text', context=False)
+
+
+class ConsoleSink(LogSink):
+
+    ''' Constructor
+        @param [in] level   - Minimum level written to this sink
+        @param [in] fmt     - Output format, see LogSink
+        @param [in] stream  - Stream to write, None for the current sys.stdout
+    '''
+    def __init__(self, level=DEBUG, fmt='color', stream=None):
+        super().__init__(level=level, fmt=fmt, context=False)
+        self.stream = stream
+        self.console = True
+
+    ''' Writes one formatted line
+        @param [in] out     - Output of this sink's format
+    '''
+    def write(self, out):
+        (self.stream if self.stream else sys.stdout).write(out)
+
+    ''' Flushes the stream
+    '''
+    def flush(self):
+        (self.stream if self.stream else sys.stdout).flush()
+
+
+class FileSink(LogSink):
+
+    ''' Constructor
+        @param [in] fname       - Log file name
+        @param [in] level       - Minimum level written to this sink
+        @param [in] fmt         - Output format, see LogSink
+        @param [in] bufsize     - Write buffer size in bytes
+        @param [in] maxsize     - Rotate the file once it grows beyond this
+                                  many bytes, zero to disable
+        @param [in] maxage      - Rotate the file once it has been open this
+                                  many seconds, zero to disable
+        @param [in] backups     - Number of rotated files to keep
+    '''
+    def __init__(self, fname, level=DEBUG, fmt='text', bufsize=65536, maxsize=0, maxage=0, backups=5):
+        super().__init__(level=level, fmt=fmt)
+        self.fname = fname
+        self.f = LogFile(fname, bufsize=bufsize, maxsize=maxsize, maxage=maxage, backups=backups,
+                         binary='binary' == fmt)
+
+    ''' Writes one formatted line
+        @param [in] out     - Output of this sink's format
+    '''
+    def write(self, out):
+        try:
+            self.f.write(out)
+        except Exception as e:
+            pass
+
+    ''' Flushes buffered data to disk
+    '''
+    def flush(self):
+        try:
+            self.f.flush()
+        except Exception as e:
+            pass
+
+    ''' Flushes and closes the file
+    '''
+    def close(self):
+        try:
+            self.f.close()
+        except Exception as e:
+            pass
+
+
+class RotatingFileSink(FileSink):
+
+    ''' Constructor
+
+        File sink that rotates by default, see FileSink
+
+        @param [in] fname       - Log file name
+        @param [in] level       - Minimum level written to this sink
+        @param [in] fmt         - Output format, see LogSink
+        @param [in] maxsize     - Rotate the file once it grows beyond this
+                                  many bytes
+        @param [in] backups     - Number of rotated files to keep
+        @param [in] maxage      - Rotate the file once it has been open this
+                                  many seconds, zero to disable
+    '''
+    def __init__(self, fname, level=DEBUG, fmt='text', maxsize=10*1024*1024, backups=5, maxage=0, bufsize=65536):
+        super().__init__(fname, level=level, fmt=fmt, bufsize=bufsize, maxsize=maxsize, maxage=maxage, backups=backups)
+
+
+class CompressedFileSink(FileSink):
+
+    ''' Constructor
+
+        Compressed log file, see CompressedLogFile and readLogLines()
+
+        @param [in] fname       - Log file name
+        @param [in] level       - Minimum level written to this sink
+        @param [in] fmt         - Output format, see LogSink
+        @param [in] codec       - 'gzip' or 'xz'
+        @param [in] compresslevel - Compression level, 0 - 9
+        @param [in] interval    - Seconds between block flushes, error
+                                  lines and async batches do not end a
+                                  block early, Logging.flush() does
+        @param [in] maxsize     - Start a new segment once the compressed file
+                                  grows beyond this many bytes, zero to disable
+        @param [in] maxage      - Start a new segment once the file has been
+                                  open this many seconds, zero to disable
+        @param [in] backups     - Number of old segments to keep
+        @param [in] bufsize     - Write buffer size in bytes
+    '''
+    def __init__(self, fname, level=DEBUG, fmt='text', codec='gzip', compresslevel=6, interval=1.0,
+                 maxsize=0, maxage=0, backups=5, bufsize=65536):
+        LogSink.__init__(self, level=level, fmt=fmt)
+        self.fname = fname
+        self.f = CompressedLogFile(fname, codec=codec, level=compresslevel, interval=interval, bufsize=bufsize,
+                                   maxsize=maxsize, maxage=maxage, backups=backups, binary='binary' == fmt)
+        self.lazy = True
+
+
+class MemorySink(LogSink):
+
+    ''' Constructor
+
+        Keeps the most recent formatted lines in memory
+
+        @param [in] size    - Number of lines to keep
+        @param [in] level   - Minimum level written to this sink
+        @param [in] fmt     - Output format, see LogSink
+    '''
+    def __init__(self, size=1000, level=DEBUG, fmt='text'):
+        super().__init__(level=level, fmt=fmt)
+        self.buf = [None] * max(1, size)
+        self.pos = 0
+
+    ''' Stores one formatted line
+        @param [in] out     - Output of this sink's format
+    '''
+    def write(self, out):
+        self.buf[self.pos % len(self.buf)] = out
+        self.pos += 1
+
+    ''' Returns the stored lines, oldest first
+    '''
+    def getLines(self):
+        n = len(self.buf)
+        return [self.buf[i % n] for i in range(max(0, self.pos - n), self.pos)]
+
+    ''' Discards the stored lines
+    '''
+    def clear(self):
+        self.buf = [None] * len(self.buf)
+        self.pos = 0
+
+
+class SocketSink(LogSink):
+
+    ''' Constructor
+
+        Sends each line as a datagram, for a local collector or syslog
+        style daemon.  Send errors are ignored so a missing listener
+        never stalls logging.
+
+        @param [in] address - (host, port) for UDP or a path for a Unix
+                              datagram socket, such as '/dev/log'
+        @param [in] level   - Minimum level written to this sink
+        @param [in] fmt     - Output format, see LogSink
+    '''
+    def __init__(self, address, level=DEBUG, fmt='json'):
+        super().__init__(level=level, fmt=fmt, context=False)
+        self.address = address
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.dropped = 0
+
+    ''' Sends one formatted line
+        @param [in] out     - Output of this sink's format
+    '''
+    def write(self, out):
+        try:
+            self.sock.sendto(out if isinstance(out, bytes) else out.encode('utf-8'), self.address)
+        except Exception as e:
+            self.dropped += 1
+
+    ''' Closes the socket
+    '''
+    def close(self):
+        self.sock.close()
+
+
+''' Adds a record to a writer queue honoring an overflow policy
+    @param [in] q           - Record queue
+    @param [in] rec         - Log record
+    @param [in] overflow    - Overflow policy, see Logging.setAsync()
+
+    @returns Number of records dropped
+'''
+def _queuePut(q, rec, overflow):
+    if 'block' == overflow:
+        q.put(rec)
+        return 0
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(rec)
+            return dropped
+        except queue.Full:
+            pass
+
+        if 'drop_newest' == overflow:
+            return dropped + 1
+
+        try:
+            old = q.get_nowait()
+        except queue.Empty:
+            continue
+        q.task_done()
+
+        # Writer is stopping, keep the stop marker
+        if old is None:
+            q.put(None)
+            return dropped + 1
+
+        dropped += 1
+
+
 class Logging:
 
     ''' Constructor
@@ -20,22 +681,38 @@ class Logging:
                                     file        = filename
                                     line        = line number
                                     function    = Function name
+                                    thread      = Thread name
+                                    pid         = Process id
+                                    elapsed     = Time since the logger was created
+                                    level       = Level name
+                                    task        = asyncio task name
 
                                     Examples:
                                         '[<<ts>>] <<file>>(<<line>>): '                 -> [10:06:37] ./test.py(147):
                                         '[<<ts>>] <<file>>::<<function>>(<<line>>): '   -> [10:08:47] ./test.py::test_5(147):
 
-        @param [in] tstmpl      - Timestamp template
+        @param [in] tstmpl      - Timestamp template, strftime() format,
+                                  %f is microseconds and %3f milliseconds
                                     Examples:
                                         '%H:%M:%S'
+                                        '%H:%M:%S.%3f'
 
         @param [in] reldir      - Relative directory to files to show in logs
                                     None    = Full paths
                                     '-'     = No paths
                                     '.'     = Relative to current working directory
                                     ...     = Relative to specified path
+
+        @param [in] tsrelative  - True to show monotonic time since the
+                                  logger was created, tstmpl is then a
+                                  formatInterval() format
+                                    Examples:
+                                        '$+H:$M:$S.$F'
+
+        @param [in] level       - Minimum level to output
+                                    DEBUG, INFO, WARN, ERROR
     '''
-    def __init__(self, dblspace=False, linetmpl=None, tstmpl='%H:%M:%S', reldir='.'):
+    def __init__(self, dblspace=False, linetmpl=None, tstmpl='%H:%M:%S', reldir='.', tsrelative=False, level=INFO):
         self.console_colors = {
             'BLACK'     : '\033[90m',
             'RED'       : '\033[91m',
@@ -55,96 +732,1288 @@ class Logging:
             'DEFAULT'   : '\033[0m'
         }
         self.console_color_filters = {}
+        self.filter_lock = threading.Lock()
+        self.lock = threading.RLock()
+        self.block_counts = {}
+        self._compileFilters()
         self.endl = os.linesep
         self.logfile = ''
+        self.logsink = None
+        self.sinks = (ConsoleSink(),)
+        self.sink_structured = False
+        self.atexit = False
+        self.queue = None
+        self.writer = None
+        self.overflow = 'block'
+        self.batchsize = 100
+        self.dropped = 0
+        self.collector = None
+        self.collbuf = []
+        self.collbatch = 1
+        self.ring = None
+        self.ringpos = 0
+        self.ringlevel = DEBUG
+        self.ringdump = ERROR
+        self.aio = AsyncLogging(self)
+
+        # Threads do not survive a fork, see _afterFork()
+        if hasattr(os, 'register_at_fork'):
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._afterFork())
+        self.collq = None
+        self.collthread = None
         self.dblspace = False
-        self.linetmpl = linetmpl
+        self.start = time.time()
+        self.mstart = time.monotonic()
+        self.setTimestamp(tstmpl, tsrelative)
+        self.tmpl_fields = {
+            'ts'        : self._fieldTs,
+            'file'      : self._fieldFile,
+            'line'      : self._fieldLine,
+            'function'  : self._fieldFunction,
+            'thread'    : self._fieldThread,
+            'pid'       : self._fieldPid,
+            'elapsed'   : self._fieldElapsed,
+            'level'     : self._fieldLevel,
+            'task'      : self._fieldTask
+        }
+        self.setLevel(level)
+        self.setLineTemplate(linetmpl)
+        self.fncache = {}
+        self.fncache_reldir = None
+        self.fncache_max = 1024
+        self.exccache = {}
+        self.exc_maxdepth = 0
+        self.exc_chain = True
+        self.rl_count = 0
+        self.rl_interval = 1.0
+        self.rl_sites = {}
+        self.rl_swept = 0
+        self.rl_suppressed = 0
+        self.rl_lock = threading.Lock()
+        self.fl_lines = 1
+        self.fl_interval = 0
+        self.fl_level = ERROR
+        self.fl_pending = 0
+        self.fl_last = time.time()
+        self.fl_thread = None
+        self.fl_stop = threading.Event()
+        self.setRelDir(reldir)
+        self.color = None
+        self.refreshColor()
+
+    ''' Adds a single filter to colorize text
+        @param [in] f   - Case insensitive filter string,
+                          values can be any of
+                            black, red, green, yellow, blue,
+                            magenta, cyan, white, bold, faint,
+                            italic, underline, blink, strikeout,
+                            block
+
+                          Lines matching a 'block' filter are dropped
+                          before any other formatting, whatever the output
+                          device.  Block filters starting with 'file=' or
+                          'function=' match the caller rather than the
+                          message.  Other block filters no longer search
+                          the line prefix, only the message, except that
+                          file names such as 'noisy.py' or 'lib/' also
+                          match the caller's file.
+
+        Example:
+        @begincode
+
+            # Color all strings containing 'error' red
+            addLogFilter("error:red")
+
+            # Drop everything logged from poll functions
+            addLogFilter("function=poll:block")
+
+            # Drop everything logged from noisy.py
+            addLogFilter("noisy.py:block")
+
+        @endcode
+    '''
+    def addLogFilter(self, f):
+        with self.filter_lock:
+            filters = dict(self.console_color_filters)
+            self._parseLogFilter(f, filters)
+            self.console_color_filters = filters
+            self._compileFilters()
+
+    ''' Adds a list of filters to colorize text
+        @param [in] f   - Comma separated case insensitive filter strings
+                          values can be any of
+                            black, red, green, yellow, blue,
+                            magenta, cyan, white, bold, faint,
+                            italic, underline, blink, strikeout,
+                            block
+
+                          See addLogFilter() for what 'block' matches
+
+        Example:
+        @begincode
+
+            # Color all strings containing 'error' red, 'warning' yellow,
+            # Texts containing 'info' will blink
+            addLogFilter("error:red,warning:yellow,info:blink")
+
+        @endcode
+    '''
+    def addLogFilters(self, f):
+        p = f.split(',')
+        if p:
+            with self.filter_lock:
+                filters = dict(self.console_color_filters)
+                for v in p:
+                    self._parseLogFilter(v, filters)
+                self.console_color_filters = filters
+                self._compileFilters()
+
+    ''' Returns the active filter strings
+    '''
+    def getLogFilters(self):
+        return self.console_color_filters
+
+    ''' Removes all filters
+    '''
+    def clearLogFilters(self):
+        with self.filter_lock:
+            self.console_color_filters = {}
+            self._compileFilters()
+
+    ''' Returns the number of lines suppressed by each block filter
+    '''
+    def getBlockCounts(self):
+        return dict(self.block_counts)
+
+    ''' Adds a single filter string to a filter table
+        @param [in] f       - Filter string, see addLogFilter()
+        @param [in] filters - Filter table to update
+    '''
+    def _parseLogFilter(self, f, filters):
+        p = f.split(':')
+        if 1 < len(p):
+            filters[p[0]] = p[1:]
+
+    ''' Builds the filter matchers
+
+        Block filters are split out into a caller stage and a message
+        stage that run before the line is built.  For color filters a
+        single case insensitive expression is used to quickly reject
+        lines that match no filter, each filter carries its color codes
+        already resolved into a prefix string.
+
+        Tables are never modified once built, new ones are swapped in so
+        logging threads can read them without locking.
+    '''
+    def _compileFilters(self):
+        flist = []
+        bcaller = []
+        bmsg = []
+        for k,v in self.console_color_filters.items():
+            beg = ''
+            block = False
+            for c in v:
+                c = c.upper()
+                if 'BLOCK' == c:
+                    block = True
+                elif c in self.console_colors:
+                    beg += self.console_colors[c]
+            if block:
+                self.block_counts.setdefault(k, 0)
+                field, _, key = k.partition('=')
+                if key and field.lower() in ('file', 'function'):
+                    bcaller.append((field.lower(), key.lower(), k))
+                else:
+                    # File names used to match the line prefix
+                    if '.py' in k or '/' in k or '\\' in k:
+                        bcaller.append(('file', k.lower(), k))
+                    bmsg.append((k.lower(), k))
+            else:
+                flist.append((k.lower(), beg))
+
+        def anyOf(keys):
+            if not keys:
+                return None
+            return re.compile('|'.join([re.escape(k) for k in keys]), re.IGNORECASE)
+
+        self.filter_color = (anyOf([k for k, pre in flist]), flist)
+        self.filter_block = (anyOf([k for k, o in bmsg]), bmsg)
+        self.filter_caller = (bcaller, {})
+
+    ''' Checks the caller against the block filters
+        @param [in] rec     - Log record
+
+        @returns True if the line should be dropped
+    '''
+    def _blockCaller(self, rec):
+        bcaller, cache = self.filter_caller
+        loc = (rec['file'], rec['function'])
+        k = cache.get(loc, False)
+        if k is False:
+            k = None
+            for field, key, orig in bcaller:
+                if key in (loc[0] if 'file' == field else loc[1]).lower():
+                    k = orig
+                    break
+            if len(cache) >= self.fncache_max:
+                cache.clear()
+            cache[loc] = k
+        if k is None:
+            return False
+        self.block_counts[k] += 1
+        return True
+
+    ''' Applies the per call site rate limit
+        @param [in] rec     - Log record
+
+        @returns True if the line should be dropped
+    '''
+    def _rateLimit(self, rec):
+        site = (rec['file'], rec['line'])
+        t = rec['t']
+        reports = []
+        drop = False
+
+        # Site state is shared by every thread, reports are written
+        # once the lock is released
+        with self.rl_lock:
+
+            # Report sites that went quiet, at most once per interval
+            if t - self.rl_swept >= self.rl_interval:
+                self.rl_swept = t
+                self._rateCollect(t, reports)
+
+            st = self.rl_sites.get(site)
+
+            # Start a new window
+            if st is None or t - st[0] >= self.rl_interval:
+                if st and st[2]:
+                    reports.append(self._rateTake(st))
+                if st is None and len(self.rl_sites) >= self.fncache_max:
+                    self._rateCollect(None, reports)
+                    self.rl_sites = {}
+                self.rl_sites[site] = [t, 1, 0, None]
+
+            elif st[1] < self.rl_count:
+                st[1] += 1
+
+            else:
+                st[2] += 1
+                st[3] = rec
+                self.rl_suppressed += 1
+                drop = True
+
+        for r in reports:
+            self._rateReport(r)
+        return drop
+
+    ''' Writes the suppressed line summaries
+        @param [in] t       - Current time, only sites whose window has
+                              ended are reported and forgotten, None to
+                              report every site now
+    '''
+    def _rateSummary(self, t=None):
+        reports = []
+        with self.rl_lock:
+            self._rateCollect(t, reports)
+        for r in reports:
+            self._rateReport(r)
+
+    ''' Takes the summaries due from the call sites, hold rl_lock
+        @param [in] t       - Current time, see _rateSummary()
+        @param [in] reports - List to append (record, count) pairs to
+    '''
+    def _rateCollect(self, t, reports):
+        for site, st in list(self.rl_sites.items()):
+            if t is None or t - st[0] >= self.rl_interval:
+                if st[2]:
+                    reports.append(self._rateTake(st))
+                if t is not None:
+                    self.rl_sites.pop(site, None)
+
+    ''' Takes the last suppressed line of a call site and its count
+        @param [in] st      - Call site state
+
+        @returns (record, count)
+    '''
+    def _rateTake(self, st):
+        r = (st[3], st[2])
+        st[2] = 0
+        st[3] = None
+        return r
+
+    ''' Writes the last suppressed line of a call site, noting the count
+        @param [in] report  - (record, count) from _rateTake()
+    '''
+    def _rateReport(self, report):
+        r, n = report
+        if r is None or r['level'] < self.level:
+            return
+        r = dict(r)
+        r['suppressed'] = n
+        if self.ts_relative:
+            r['mt'] = time.monotonic() - (time.time() - r['t'])
+        self._dispatch(r)
+
+    ''' Checks a message against the block filters
+        @param [in] s       - Message string
+
+        @returns True if the line should be dropped
+    '''
+    def _blockMessage(self, s):
+        rx, bmsg = self.filter_block
+        if not rx or not rx.search(s):
+            return False
+        sl = s.lower()
+        for key, orig in bmsg:
+            if key in sl:
+                self.block_counts[orig] += 1
+                return True
+        return False
+
+    ''' Matches a line against the color filters
+        @param [in] s       - Message string
+        @param [in] ls      - Line prefix string
+
+        @returns Color prefix string
+    '''
+    def _matchFilters(self, s, ls):
+        rx, flist = self.filter_color
+        if not rx or (not rx.search(s) and not rx.search(ls)):
+            return ''
+
+        beg = ''
+        sl = s.lower()
+        lsl = ls.lower()
+        for k, pre in flist:
+            if k in sl or k in lsl:
+                beg += pre
+
+        return beg
+
+    ''' Sets a log file name
+
+        The file is kept open and written through a buffer, call flush()
+        to force data to disk, buffers are also flushed at exit.
+
+        @param [in] fname       - File in which to write logs,
+                                  empty to stop writing to a file
+        @param [in] bufsize     - Write buffer size in bytes
+        @param [in] maxsize     - Rotate the file once it grows beyond this
+                                  many bytes, zero to disable
+        @param [in] maxage      - Rotate the file once it has been open this
+                                  many seconds, zero to disable
+        @param [in] backups     - Number of rotated files to keep
+        @param [in] fmt         - File format, the console is not affected
+                                    'text'      = Same lines as the console
+                                    'json'      = One compact JSON object per line
+                                    'binary'    = Length prefixed binary records
+
+                                  Structured records hold
+                                    ts, level, file, line, function, message
+                                  and exception, a list of
+                                    type, message, frames [file, line, function]
+
+                                  Use readLogRecords() to read them back.
+    '''
+    def setLogFile(self, fname, bufsize=65536, maxsize=0, maxage=0, backups=5, fmt='text'):
+        if fmt not in ('text', 'json', 'binary'):
+            raise ValueError("Invalid log file format: %s" % fmt)
+        self.close()
+        with self.lock:
+            self.logfile = fname
+            if fname:
+                self.logsink = FileSink(fname, fmt=fmt, bufsize=bufsize, maxsize=maxsize, maxage=maxage, backups=backups)
+                self.addSink(self.logsink)
+
+    ''' Adds an output
+        @param [in] sink    - LogSink object
+    '''
+    def addSink(self, sink):
+        with self.lock:
+            self.sinks = self.sinks + (sink,)
+            self._updateSinks()
+        self._registerAtExit()
+
+    ''' Removes an output, the sink is closed
+
+        Sinks are chosen as records are written, so queued records are
+        written first.
+
+        @param [in] sink    - LogSink object to remove
+    '''
+    def removeSink(self, sink):
+        self.flush()
+        with self.lock:
+            self.sinks = tuple([k for k in self.sinks if k is not sink])
+            if sink is self.logsink:
+                self.logsink = None
+            self._updateSinks()
+        sink.close()
+
+    ''' Returns the active outputs
+    '''
+    def getSinks(self):
+        return list(self.sinks)
+
+    ''' Notes what the sinks need from each record
+    '''
+    def _updateSinks(self):
+        self.sink_structured = 0 < len([k for k in self.sinks if k.fmt not in ('color', 'text')])
+
+    ''' Enables asynchronous logging
+
+        Callers only capture the call site and arguments and push a record
+        onto a queue, a background thread formats and writes the records
+        in batches.  Note that arguments are converted to strings on the
+        writer thread.
+
+        @param [in] enable      - True to enable, False to drain the queue
+                                  and return to synchronous logging
+        @param [in] queuesize   - Maximum number of queued records
+        @param [in] overflow    - What to do when the queue is full
+                                    'block'         = Wait for space
+                                    'drop_newest'   = Discard the new record
+                                    'drop_oldest'   = Discard the oldest queued record
+        @param [in] batchsize   - Maximum records written between flushes
+    '''
+    def setAsync(self, enable=True, queuesize=10000, overflow='block', batchsize=100):
+
+        # Drain and stop any existing writer
+        if self.queue:
+            q = self.queue
+            self.queue = None
+            q.put(None)
+            self.writer.join()
+            self.writer = None
+
+        if not enable:
+            return
+
+        if overflow not in ('block', 'drop_newest', 'drop_oldest'):
+            raise ValueError("Invalid overflow policy: %s" % overflow)
+
+        self.overflow = overflow
+        self.batchsize = max(1, batchsize)
+        self.queue = queue.Queue(maxsize=queuesize)
+        self.writer = threading.Thread(target=self._writerThread, args=(self.queue,), daemon=True)
+        self.writer.start()
+        self._registerAtExit()
+
+    ''' Resets state inherited from the parent process after a fork
+
+        The child gets copies of the queues, collector and locks but none
+        of the threads behind them, queued records would never be written
+        and flush() would wait forever.  Records still queued belong to
+        the parent, which writes them.
+    '''
+    def _afterFork(self):
+        self.lock = threading.RLock()
+        self.filter_lock = threading.Lock()
+        self.rl_lock = threading.Lock()
+        self.queue = None
+        self.writer = None
+        self.aio = AsyncLogging(self, queuesize=self.aio.queuesize, overflow=self.aio.overflow)
+        self.collq = None
+        self.collthread = None
+        self.collbuf = []
+        self.fl_thread = None
+        self.fl_stop = threading.Event()
+
+    ''' Starts collecting records from other processes
+
+        Pass the returned queue to worker processes and call
+        sparen.setCollector() in each one, typically as a pool initializer.  Workers render their
+        messages and send the records here, a thread in this process writes
+        them in batches through this logger's outputs.
+
+        @param [in] ctx     - Optional multiprocessing context
+
+        @returns Queue to hand to sparen.setCollector() in the workers
+
+        Example:
+        @begincode
+
+            q = sparen.log.startCollector()
+            with multiprocessing.Pool(8, initializer=sparen.setCollector, initargs=(q,)) as pool:
+                pool.map(work, items)
+            sparen.log.stopCollector()
+
+        @endcode
+    '''
+    def startCollector(self, ctx=None):
+        if self.collq:
+            return self.collq
+        # SimpleQueue writes on the calling thread, so a record is in the
+        # pipe once put() returns, even if the worker is then terminated
+        self.collq = (ctx if ctx else multiprocessing).SimpleQueue()
+        self.collthread = threading.Thread(target=self._collectorThread, args=(self.collq,), daemon=True)
+        self.collthread.start()
+        self._registerAtExit()
+        return self.collq
+
+    ''' Writes all records received so far and stops the collector
+    '''
+    def stopCollector(self):
+        if not self.collq:
+            return
+        q = self.collq
+        self.collq = None
+        q.put(None)
+        self.collthread.join()
+        self.collthread = None
+        q.close()
+
+    ''' Sends this logger's records to a collecting process
+
+        Messages and line prefixes are rendered in this process, the
+        collector only applies colors and writes.
+
+        @param [in] q           - Queue from startCollector() in the
+                                  collecting process, None to write
+                                  locally again
+        @param [in] batchsize   - Records to send at once, with more than
+                                  one call flush() before the worker
+                                  finishes or buffered records are lost,
+                                  lines at or above the flush policy
+                                  level are always sent right away
+    '''
+    def setCollector(self, q, batchsize=1):
+        self._sendCollector()
+        self.collector = q
+        self.collbatch = max(1, batchsize)
+
+    ''' Sends buffered records to the collecting process
+    '''
+    def _sendCollector(self):
+        with self.lock:
+            buf = self.collbuf
+            if buf and self.collector:
+                self.collbuf = []
+                self.collector.put(buf)
+
+    ''' Writes records received from other processes until stopped
+        @param [in] q       - Record queue
+    '''
+    def _collectorThread(self, q):
+        done = False
+        while not done:
+            batches = [q.get()]
+            while len(batches) < self.batchsize and not q.empty():
+                batches.append(q.get())
+
+            for recs in batches:
+                if recs is None:
+                    done = True
+                    break
+                for rec in recs:
+                    try:
+                        self._emit(rec, False)
+                    except Exception as e:
+                        pass
+
+            self._flushOutputs(False)
+
+    ''' Returns the number of records dropped because the queue was full
+    '''
+    def getDropped(self):
+        return self.dropped
+
+    ''' Flushes buffered log data
+
+        In asynchronous mode this waits until all queued records are written
+    '''
+    def flush(self):
+        if self.rl_count:
+            self._rateSummary()
+        self._sendCollector()
+        self.aio._join()
+        q = self.queue
+        if q and threading.current_thread() is not self.writer:
+            q.join()
+        self._flushOutputs()
+
+    ''' Sets when console output is flushed
+
+        Flushing less often lets the stream buffer turn many lines into a
+        single write.  Line counts and levels are checked as lines are
+        written, a background thread flushes lines left waiting longer
+        than the interval.  Call flush() to force output.
+
+        @param [in] lines       - Flush every this many lines, zero to
+                                  never flush on a line count
+        @param [in] interval    - Flush lines that have waited this many
+                                  seconds, zero to disable
+        @param [in] level       - Flush both the console and the log file
+                                  on lines at or above this level
+    '''
+    def setFlushPolicy(self, lines=1, interval=0, level=ERROR):
+        with self.lock:
+            self.fl_lines = lines
+            self.fl_interval = interval
+            self.fl_level = level
+            if not interval and self.fl_thread:
+                self.fl_stop.set()
+                self.fl_stop = threading.Event()
+                self.fl_thread = None
+
+    ''' Flushes stdout if the flush policy says so
+        @param [in] rec     - Log record just written
+    '''
+    def _flushPolicy(self, rec):
+        self.fl_pending += 1
+        if self.fl_interval and not self.fl_thread:
+            self.fl_thread = threading.Thread(target=self._flushThread, args=(self.fl_stop,), daemon=True)
+            self.fl_thread.start()
+        if rec.get('level', INFO) >= self.fl_level:
+            self._flushOutputs(False)
+        elif (self.fl_lines and self.fl_pending >= self.fl_lines) \
+                or (self.fl_interval and rec['t'] - self.fl_last >= self.fl_interval):
+            self._flushStdout()
+
+    ''' Flushes lines that have waited for the flush interval
+        @param [in] stop    - Event set to stop the thread
+    '''
+    def _flushThread(self, stop):
+        while True:
+            t = self.fl_interval
+            wait = t - (time.time() - self.fl_last) if self.fl_pending else t
+            if not t or stop.wait(max(wait, 0.001)):
+                break
+            with self.lock:
+                if self.fl_pending and time.time() - self.fl_last >= self.fl_interval:
+                    self._flushStdout()
+
+    ''' Flushes stdout and the console sinks
+    '''
+    def _flushStdout(self):
+        self.fl_pending = 0
+        self.fl_last = time.time()
+        sys.stdout.flush()
+        for sink in self.sinks:
+            if sink.console:
+                sink.flush()
+
+    ''' Flushes stdout and all sinks
+        @param [in] lazy    - False to skip sinks that flush on their own
+                              schedule, see LogSink
+    '''
+    def _flushOutputs(self, lazy=True):
+        with self.lock:
+            self._flushStdout()
+            for sink in self.sinks:
+                if not sink.console and (lazy or not sink.lazy):
+                    sink.flush()
+
+    ''' Registers the exit handler once
+    '''
+    def _registerAtExit(self):
+        if not self.atexit:
+            atexit.register(self._atExit)
+            self.atexit = True
+
+    ''' Drains queued records and flushes output at exit
+    '''
+    def _atExit(self):
+        self.aio._stop()
+        self.setAsync(False)
+        self.stopCollector()
+        self.flush()
+
+    ''' Flushes and closes the log file
+    '''
+    def close(self):
+        sink = self.logsink
+        if sink:
+            self.removeSink(sink)
+        elif self.rl_count:
+            self._rateSummary()
+
+    ''' Sets the timestamp template
+        @param [in] tstmpl      - Timestamp template, see the constructor
+        @param [in] relative    - True for monotonic time since the logger
+                                  was created
+    '''
+    def setTimestamp(self, tstmpl, relative=False):
         self.tstmpl = tstmpl
+        self.ts_relative = relative
+        self._compileTimestamp()
+
+    ''' Splits the timestamp template into whole second and fractional parts
+
+        The whole second parts only change once per second and are cached,
+        fractional fields are patched in for each line.
+    '''
+    def _compileTimestamp(self):
+        parts = []
+        if self.tstmpl:
+            if self.ts_relative:
+                tok = re.split(r'(\$[fF])', self.tstmpl)
+            else:
+                tok = re.split(r'(%%|%[1-6]?f)', self.tstmpl)
+            for i in range(0, len(tok)):
+                p = tok[i]
+                if not i % 2:
+                    if p:
+                        parts.append((p, 0, False))
+                elif '%%' == p:
+                    parts.append((p, 0, False))
+                elif self.ts_relative:
+                    parts.append(('', 3, '$f' == p))
+                else:
+                    parts.append(('', int(p[1:-1]) if 2 < len(p) else 6, False))
+
+        self.ts_parts = parts
+        self.ts_frac = 0 < len([p for p in parts if p[1]])
+        self.ts_cache = (None, [])
+        self.ts_src = self.tstmpl
+
+    ''' Formats the timestamp for a record
+        @param [in] rec     - Log record
+    '''
+    def _formatTimestamp(self, rec):
+
+        if self.ts_src is not self.tstmpl:
+            self._compileTimestamp()
+
+        if self.ts_relative:
+            t = rec.get('mt', self.mstart) - self.mstart
+        else:
+            t = rec['t']
+        sec = math.floor(t)
+
+        # Render whole second parts once per second
+        cache = self.ts_cache
+        if sec != cache[0]:
+            if self.ts_relative:
+                rp = [formatInterval(sec, p) if not n else '' for p, n, strip in self.ts_parts]
+            else:
+                dt = datetime.datetime.fromtimestamp(sec)
+                rp = [dt.strftime(p) if not n else '' for p, n, strip in self.ts_parts]
+            cache = (sec, rp)
+            self.ts_cache = cache
+
+        if not self.ts_frac:
+            return ''.join(cache[1])
+
+        # Patch in fractional fields
+        frac = t - sec
+        out = []
+        i = 0
+        for p, n, strip in self.ts_parts:
+            if n:
+                f = str(min(int(round(frac * 10**n)), 10**n - 1)).rjust(n, '0')
+                out.append(f.rstrip('0') if strip else f)
+            else:
+                out.append(cache[1][i])
+            i += 1
+        return ''.join(out)
+
+    ''' Sets the line template
+        @param [in] linetmpl    - Line template, see the constructor,
+                                  None for the default
+    '''
+    def setLineTemplate(self, linetmpl):
+        self.linetmpl = linetmpl
+        self._compileTemplate()
+
+    ''' Compiles the line template into literal chunks and field getters
+
+        Only the information needed by fields present in the template is
+        gathered when a line is logged, for example the caller is not
+        looked up if there are no file, line or function fields.
+    '''
+    def _compileTemplate(self):
+        src = self.linetmpl if self.linetmpl else '[<<ts>>] <<file>>(<<line>>): '
+
+        tmpl = []
+        need = set()
+        lit = ''
+        parts = re.split(r'<<(\w+)>>', src)
+        for i in range(0, len(parts)):
+            p = parts[i]
+            if i % 2:
+                if p in self.tmpl_fields:
+                    if lit:
+                        tmpl.append((lit, None))
+                        lit = ''
+                    tmpl.append(('', self.tmpl_fields[p]))
+                    need.add(p)
+                    continue
+                p = '<<' + p + '>>'
+            lit += p
+        if lit:
+            tmpl.append((lit, None))
+
+        self.tmpl = tmpl
+        self.tmpl_src = self.linetmpl
+        self.tmpl_caller = 0 < len(need & {'file', 'line', 'function'})
+        self.tmpl_thread = 'thread' in need
+        self.tmpl_pid = 'pid' in need
+        self.tmpl_task = 'task' in need
+
+    ''' Sets the minimum level to output
+        @param [in] level   - DEBUG, INFO, WARN, ERROR or the level name
+    '''
+    def setLevel(self, level):
+        if isinstance(level, str):
+            level = LEVEL_VALUES[level.upper()]
+        self.level = level
+        self._updateMinLevel()
+
+    ''' Lowest level that needs to be captured at all
+    '''
+    def _updateMinLevel(self):
+        self.minlevel = min(self.level, self.ringlevel) if self.ring else self.level
+
+    ''' Keeps recent lines below the output level in memory
+
+        Lines below the output level but at or above the ring level are
+        stored unformatted in a fixed size ring, which costs no I/O.
+        When an error level line or an exception is logged, the ring is
+        formatted and written to the log file first (or the console if
+        there is no log file) to show what led up to it.
+
+        @param [in] size        - Number of lines to keep, zero to disable
+        @param [in] level       - Lowest level to keep
+        @param [in] dumplevel   - Lines at or above this level dump the ring
+    '''
+    def setRingBuffer(self, size=0, level=DEBUG, dumplevel=ERROR):
+        with self.lock:
+            self.ring = [None] * size if 0 < size else None
+            self.ringpos = 0
+            self.ringlevel = level
+            self.ringdump = dumplevel
+        self._updateMinLevel()
+
+    ''' Adds a record to the ring
+        @param [in] rec     - Log record
+    '''
+    def _ringAppend(self, rec):
+        with self.lock:
+            ring = self.ring
+            if ring:
+                ring[self.ringpos % len(ring)] = rec
+                self.ringpos += 1
+
+    ''' Removes and returns the records in the ring, oldest first
+    '''
+    def _ringTake(self):
+        with self.lock:
+            ring = self.ring
+            if not ring or not self.ringpos:
+                return []
+            n = len(ring)
+            p = self.ringpos
+            recs = [ring[i % n] for i in range(max(0, p - n), p)]
+            for i in range(0, n):
+                ring[i] = None
+            self.ringpos = 0
+            return recs
+
+    ''' Returns the minimum level to output
+    '''
+    def getLevel(self):
+        return self.level
+
+    ''' Timestamp field, template field getters return the field string for a record
+        @param [in] rec     - Log record
+    '''
+    def _fieldTs(self, rec):
+        return self._formatTimestamp(rec)
+
+    ''' Display file name field
+    '''
+    def _fieldFile(self, rec):
+        full = rec.get('file')
+        return self._getFilename(full) if full else '?'
+
+    ''' Line number field
+    '''
+    def _fieldLine(self, rec):
+        return str(rec.get('line', 0))
+
+    ''' Function name field
+    '''
+    def _fieldFunction(self, rec):
+        return str(rec.get('function', '?'))
+
+    ''' Thread name field
+    '''
+    def _fieldThread(self, rec):
+        return str(rec.get('thread', '?'))
+
+    ''' Process id field
+    '''
+    def _fieldPid(self, rec):
+        return str(rec.get('pid', 0))
+
+    ''' Time since the logger was created field
+    '''
+    def _fieldElapsed(self, rec):
+        return formatInterval(rec['t'] - self.start, "$+H:$M:$S.$F")
+
+    ''' Level name field
+    '''
+    def _fieldLevel(self, rec):
+        return LEVEL_NAMES.get(rec.get('level', INFO), '?')
+
+    ''' asyncio task name field
+    '''
+    def _fieldTask(self, rec):
+        return str(rec.get('task') or '-')
+
+    ''' Sets the directory file names are shown relative to
+        @param [in] reldir      - Relative directory to files to show in logs
+                                    None    = Full paths
+                                    '-'     = No paths
+                                    '.'     = Relative to current working directory
+                                    ...     = Relative to specified path
+    '''
+    def setRelDir(self, reldir):
         if reldir == '.':
             self.reldir = os.getcwd()
         else:
-            self.reldir = reldir
+            self.reldir = reldir
+        self.fncache = {}
+        self.fncache_reldir = self.reldir
+
+    ''' Limits how often a single call site can log
+
+        Lines over the limit are dropped based on the caller location
+        alone, before the message is formatted.  Once the window ends,
+        or on flush(), the last dropped line is written noting how many
+        lines were suppressed.  Windows are checked as lines are logged,
+        at most once per interval.
+
+        @param [in] count       - Lines allowed per call site per interval,
+                                  zero to disable
+        @param [in] interval    - Interval in seconds
+    '''
+    def setRateLimit(self, count=0, interval=1.0):
+        with self.rl_lock:
+            self.rl_count = count
+            self.rl_interval = interval
+            self.rl_sites = {}
+            self.rl_swept = 0
+        if count:
+            self._registerAtExit()
+
+    ''' Returns the total number of lines dropped by the rate limit
+    '''
+    def getRateLimited(self):
+        return self.rl_suppressed
+
+    ''' Sets how exceptions are rendered
+        @param [in] maxdepth    - Maximum frames to show per exception,
+                                  zero for all
+        @param [in] chain       - True to also show the cause / context
+                                  of chained exceptions
+    '''
+    def setExceptionFormat(self, maxdepth=0, chain=True):
+        self.exc_maxdepth = maxdepth
+        self.exc_chain = chain
+
+    ''' Sets whether console output is colored
+        @param [in] enable  - True to always color, False to never color,
+                              None to detect the terminal capability
+    '''
+    def setColor(self, enable=None):
+        self.color = enable
+        self.refreshColor()
+
+    ''' Determines terminal color capability and renders the color context
+
+        Call this if stdout is redirected at runtime.  Unless overridden by
+        setColor(), NO_COLOR disables color, FORCE_COLOR enables it, and
+        otherwise color is used if stdout is a terminal.
+    '''
+    def refreshColor(self):
+        if self.color is not None:
+            usecolor = self.color
+        elif os.environ.get('NO_COLOR'):
+            usecolor = False
+        elif os.environ.get('FORCE_COLOR'):
+            usecolor = os.environ.get('FORCE_COLOR') not in ('0', 'false')
+        else:
+            try:
+                usecolor = sys.stdout.isatty()
+            except Exception as e:
+                usecolor = False
+
+        self.usecolor = usecolor
+        if usecolor:
+            self.sctx = self.console_colors['BLUE'] + self.console_colors['FAINT']
+            self.ectx = self.console_colors['DEFAULT']
+        else:
+            self.sctx = ''
+            self.ectx = ''
+
+    ''' Enable to add double spacing to log output
+    '''
+    def setDoubleSpace(self, enable):
+        self.dblspace = enable
+
+    ''' Returns the filename, line number and function name of a caller
+
+        Walks the frame chain directly rather than using inspect.stack(),
+        which builds info for every frame and reads source lines from disk.
+
+        @param [in] st      - Stack depth, relative to the calling function
+
+        @returns Tuple of (filename, lineno, function)
+    '''
+    def _getCaller(self, st):
+        try:
+            if _getframe:
+                f = _getframe(st + 1)
+            else:
+                f = inspect.currentframe().f_back
+                for i in range(0, st):
+                    f = f.f_back
+        except ValueError:
+            f = None
+        if not f:
+            return ('?', 0, '?')
+        return (f.f_code.co_filename, f.f_lineno, f.f_code.co_name)
+
+    ''' Returns the display name for a source file
+
+        Results are cached per file name, the cache is discarded
+        whenever the relative directory changes.
+
+        @param [in] full    - Source file name as reported by the frame
+    '''
+    def _getFilename(self, full):
+
+        if self.fncache_reldir != self.reldir:
+            self.fncache = {}
+            self.fncache_reldir = self.reldir
+
+        filename = self.fncache.get(full)
+        if filename is not None:
+            return filename
+
+        if self.reldir:
+            if '-' == self.reldir:
+                filename = os.path.basename(full)
+            else:
+                usefull = False
+                try:
+                    if full.split('/')[1] != self.reldir.split('/')[1]:
+                        usefull = True
+                except Exception as e:
+                    usefull = False
+
+                if usefull:
+                    filename = os.path.abspath(full)
+                else:
+                    filename = "./" + os.path.relpath(full, self.reldir)
+        else:
+            filename = os.path.abspath(full)
 
-    ''' Adds a single filter to colorize text
-        @param [in] f   - Case insensitive filter string,
-                          values can be any of
-                            black, red, green, yellow, blue,
-                            magenta, cyan, white, bold, faint,
-                            italic, underline, blink, strikeout
+        if len(self.fncache) >= self.fncache_max:
+            self.fncache = {}
+        self.fncache[full] = filename
 
-        Example:
-        @begincode
+        return filename
 
-            # Color all strings containing 'error' red
-            addLogFilter("error:red")
+    ''' Renders an exception and its traceback, innermost frame first
 
-        @endcode
-    '''
-    def addLogFilter(self, f):
-        p = f.split(':')
-        if 1 < len(p):
-            self.console_color_filters[p[0]] = p[1:]
+        Frames are read directly from __traceback__, the rendered line for
+        each code location is cached so repeated exceptions are cheap.
 
-    ''' Adds a list of filters to colorize text
-        @param [in] f   - Comma separated case insensitive filter strings
-                          values can be any of
-                            black, red, green, yellow, blue,
-                            magenta, cyan, white, bold, faint,
-                            italic, underline, blink, strikeout
+        @param [in] e       - Exception to render
+    '''
+    def _formatException(self, e):
+        out = []
+        seen = set()
+        cache = self.exccache
+        prefix = '[EXCEPTION] '
+        while e is not None and id(e) not in seen:
+            seen.add(id(e))
 
-        Example:
-        @begincode
+            try:
+                msg = str(e)
+            except Exception as ex:
+                msg = '<exception str() failed>'
+            out.append(prefix + msg + self.endl)
+
+            frames = []
+            tb = e.__traceback__
+            while tb is not None:
+                frames.append((tb.tb_frame.f_code, tb.tb_lineno))
+                tb = tb.tb_next
+            frames.reverse()
+
+            more = 0
+            if self.exc_maxdepth and len(frames) > self.exc_maxdepth:
+                more = len(frames) - self.exc_maxdepth
+                frames = frames[:self.exc_maxdepth]
+
+            for f in frames:
+                line = cache.get(f)
+                if line is None:
+                    co, lineno = f
+                    src = linecache.getline(co.co_filename, lineno).strip()
+                    line = " > %s(%s)::%s() %s%s" % (os.path.basename(co.co_filename), lineno, co.co_name, src, self.endl)
+                    if len(cache) >= self.fncache_max:
+                        cache = self.exccache = {}
+                    cache[f] = line
+                out.append(line)
+
+            if more:
+                out.append(" > ... %d more%s" % (more, self.endl))
+
+            if not self.exc_chain:
+                break
+            if e.__cause__ is not None:
+                e = e.__cause__
+                prefix = '[CAUSED BY] '
+            elif e.__context__ is not None and not e.__suppress_context__:
+                e = e.__context__
+                prefix = '[DURING HANDLING OF] '
+            else:
+                break
 
-            # Color all strings containing 'error' red, 'warning' yellow,
-            # Texts containing 'info' will blink
-            addLogFilter("error:red,warning:yellow,info:blink")
+        return ''.join(out)
 
-        @endcode
+    ''' Returns an exception as a structure for structured log files
+        @param [in] e       - Exception
     '''
-    def addLogFilters(self, f):
-        p = f.split(',')
-        if p:
-            for v in p:
-                self.addLogFilter(v)
+    def _exceptionInfo(self, e):
+        frames = []
+        tb = e.__traceback__
+        while tb is not None:
+            co = tb.tb_frame.f_code
+            frames.append({'file': co.co_filename, 'line': tb.tb_lineno, 'function': co.co_name})
+            tb = tb.tb_next
+        frames.reverse()
+        if self.exc_maxdepth:
+            frames = frames[:self.exc_maxdepth]
+        try:
+            msg = str(e)
+        except Exception as ex:
+            msg = '<exception str() failed>'
+        return {'type': type(e).__name__, 'message': msg, 'frames': frames}
 
-    ''' Returns the active filter strings
+    ''' Internal log function allow the specification of the logging depth
+        @param [in] st          - Stack depth
+        @param [in] args        - Log message arguments to format
+        @param [in] level       - Log level
+        @param [in] dispatch    - Function taking the finished records,
+                                  None for _dispatch()
     '''
-    def getLogFilters(self):
-        return self.console_color_filters
+    def _Log(self, st, *args, level=INFO, dispatch=None):
+
+        if not dispatch:
+            dispatch = self._dispatch
+
+        if self.tmpl_src is not self.linetmpl:
+            self._compileTemplate()
+
+        rec = {'t': time.time(), 'level': level, 'args': args}
+        if self.tmpl_caller or self.filter_caller[0] or self.rl_count or self.collector or self.sink_structured:
+            rec['file'], rec['line'], rec['function'] = self._getCaller(st)
+            if self.filter_caller[0] and self._blockCaller(rec):
+                return
+            if self.rl_count and self._rateLimit(rec):
+                return
+        if self.ts_relative:
+            rec['mt'] = time.monotonic()
+        if self.tmpl_thread or self.collector:
+            rec['thread'] = threading.current_thread().name
+        if self.tmpl_pid or self.collector:
+            rec['pid'] = os.getpid()
+        if self.tmpl_task:
+            try:
+                task = asyncio.current_task()
+                rec['task'] = task.get_name() if task else None
+            except RuntimeError:
+                rec['task'] = None
+
+        # Keep lines below the output level for context
+        if level < self.level:
+            if self.ring and level >= self.ringlevel:
+                self._ringAppend(rec)
+            return
+
+        if self.ring and (level >= self.ringdump or [a for a in args if isinstance(a, Exception)]):
+            for r in self._ringTake():
+                r['ring'] = True
+                dispatch(r)
+
+        dispatch(rec)
+
+    ''' Sends a record to the queue or writes it
+        @param [in] rec     - Log record
+    '''
+    def _dispatch(self, rec):
+        if self.queue:
+            self._enqueue(rec)
+        else:
+            self._emit(rec)
 
-    ''' Sets a log file name
-        @param [in] fname   - File in which to write logs
+    ''' Adds a record to the asynchronous queue honoring the overflow policy
+        @param [in] rec     - Log record
     '''
-    def setLogFile(self, fname):
-        self.logfile = fname
+    def _enqueue(self, rec):
+        self.dropped += _queuePut(self.queue, rec, self.overflow)
 
-    ''' Enable to add double spacing to log output
+    ''' Writes queued records until the stop marker is received
+        @param [in] q       - Record queue
     '''
-    def setDoubleSpace(self, enable):
-        self.dblspace = enable
+    def _writerThread(self, q):
+        done = False
+        while not done:
+            recs = [q.get()]
+            while len(recs) < self.batchsize:
+                try:
+                    recs.append(q.get_nowait())
+                except queue.Empty:
+                    break
 
-    ''' Internal log function allow the specification of the logging depth
-        @param [in] st      - Stack depth
-        @param [in] args    - Log message arguments to format
+            for rec in recs:
+                if rec is None:
+                    done = True
+                else:
+                    try:
+                        self._emit(rec, False)
+                    except Exception as e:
+                        pass
+
+            self._flushOutputs(False)
+            for rec in recs:
+                q.task_done()
+
+        # Anything that raced in behind the stop marker
+        while True:
+            try:
+                rec = q.get_nowait()
+            except queue.Empty:
+                break
+            if rec is not None:
+                self._emit(rec, False)
+            q.task_done()
+        self._flushOutputs()
+
+    ''' Renders the message text of a record
+        @param [in] rec     - Log record
+
+        @returns The message, or None if the line is blocked
     '''
-    def _Log(self, st, *args):
+    def _formatMessage(self, rec):
+
+        args = rec['args']
 
         def formatStr(s):
 
             if isinstance(s, Exception):
                 try:
-                    tb = traceback.TracebackException.from_exception(s)
-                    st = tb._str
-                    if not st:
-                        st = str(s)
-                    st += self.endl
-                    for d in range(len(tb.stack)-1, -1, -1):
-                        filename = os.path.basename(str(tb.stack[d][0]))
-                        lineno = str(tb.stack[d][1])
-                        fname = str(tb.stack[d][2])
-                        line = str(tb.stack[d][3])
-                        st += " > %s(%s)::%s() %s%s" % (filename, lineno, fname, line, self.endl)
-                    return "[EXCEPTION] " + st
+                    if self.sink_structured:
+                        rec.setdefault('exc', []).append(self._exceptionInfo(s))
+                    return self._formatException(s)
                 except Exception as e:
                     return str("[EXCEPTION]" + traceback.format_exc())
 
@@ -161,97 +2030,153 @@ class Logging:
                         s += ' '
                 s += formatStr(a)
 
-        # Show file/function/line
-        fi = inspect.getframeinfo(inspect.stack()[st][0])
+        s = str(s)
+        if 'suppressed' in rec:
+            s = "[%d repeated lines suppressed] %s" % (rec['suppressed'], s)
 
-        full = fi.filename
-        path = os.path.dirname(full)
+        # Drop blocked lines before building the rest
+        if self.filter_block[1] and self._blockMessage(s):
+            return None
 
-        if self.reldir:
-            if '-' == self.reldir:
-                filename = os.path.basename(fi.filename)
-            else:
-                usefull = False
-                try:
-                    if full.split('/')[1] != self.reldir.split('/')[1]:
-                        usefull = True
-                except Exception as e:
-                    usefull = False
+        return s
 
-                if usefull:
-                    filename = os.path.abspath(fi.filename)
-                else:
-                    filename = "./" + os.path.relpath(full, self.reldir)
-        else:
-            filename = os.path.abspath(fi.filename)
+    ''' Formats a log record and writes it to the outputs
+        @param [in] rec     - Log record
+        @param [in] flush   - True to apply the flush policy after writing
+    '''
+    def _emit(self, rec, flush=True):
 
-        # Timestamp
-        if self.tstmpl:
-            ts = datetime.datetime.now().strftime(self.tstmpl)
+        # Message may already be rendered by another process
+        if 's' in rec:
+            s = rec['s']
         else:
-            ts = ''
+            s = self._formatMessage(rec)
+            if s is None:
+                return
 
         # Build template
-        if self.linetmpl:
-            ls = (self.linetmpl.replace('<<ts>>', ts)
-                               .replace('<<file>>', filename)
-                               .replace('<<line>>', str(fi.lineno))
-                               .replace('<<function>>', str(fi.function))
-                )
+        if 'ls' in rec:
+            ls = rec['ls']
         else:
-            ls = f'[{ts}] {filename}({fi.lineno}): '
-
-        s = str(s)
+            ls = ''.join([g(rec) if g else lit for lit, g in self.tmpl])
+
+        # Forward to the collecting process
+        if self.collector:
+            fwd = {k: v for k, v in rec.items() if 'args' != k}
+            fwd['s'] = s
+            fwd['ls'] = ls
+            with self.lock:
+                self.collbuf.append(fwd)
+                if len(self.collbuf) >= self.collbatch or fwd['level'] >= self.fl_level:
+                    self._sendCollector()
+            return
+
+        # Pick the sinks for this line, context from the ring buffer goes
+        # to sinks that want it, or everywhere if none do
+        level = rec.get('level', INFO)
+        sinks = [k for k in self.sinks if level >= k.level]
+        if rec.get('ring'):
+            ctx = [k for k in sinks if k.context]
+            if ctx:
+                sinks = ctx
+
+        # Render each format once, everything is built on this thread
+        outs = {}
+        for sink in sinks:
+            if sink.fmt not in outs:
+                outs[sink.fmt] = self._render(sink.fmt, rec, s, ls)
+
+        # Hold the lock only to write
+        with self.lock:
+            for sink in sinks:
+                sink.write(outs[sink.fmt])
+
+            if flush:
+                self._flushPolicy(rec)
+
+    ''' Renders a line in one of the sink formats
+        @param [in] fmt     - Format, see LogSink
+        @param [in] rec     - Log record
+        @param [in] s       - Message string
+        @param [in] ls      - Line prefix string
+    '''
+    def _render(self, fmt, rec, s, ls):
 
-        # Apply color filters
-        beg = ''
-        end = ''
-        if sys.stdout.isatty():
-            try:
-                for k,v in self.console_color_filters.items():
-                    if 0 <= s.lower().find(k.lower()) or 0 <= ls.lower().find(k.lower()):
-                        for c in v:
-                            c = c.upper()
-                            if 'BLOCK' == c:
-                                return
-                            elif c in self.console_colors:
-                                beg += self.console_colors[c]
-                                if not end:
-                                    end = self.console_colors['DEFAULT']
+        # End of line
+        endl = self.endl if self.dblspace else ''
 
-            except Exception as e:
-                print(e)
-                beg = ''
-                end = ''
+        if 'color' == fmt:
 
-        # Context color
-        sctx = ''
-        ectx = ''
-        if sys.stdout.isatty():
-            sctx = self.console_colors['BLUE'] + self.console_colors['FAINT']
-            ectx = self.console_colors['DEFAULT']
+            # Apply color filters
+            beg = ''
+            end = ''
+            if self.usecolor:
+                try:
+                    beg = self._matchFilters(s, ls)
+                    if beg:
+                        end = self.ectx
 
-        # End of line
-        endl = self.endl if self.dblspace else ''
+                except Exception as e:
+                    print(e)
+                    beg = ''
+                    end = ''
+
+            return self.sctx + ls + self.ectx + beg + s + end + endl + '\n'
+
+        if 'text' == fmt:
+            return ls + s + self.endl + endl
+
+        r = {
+            'ts'        : rec['t'],
+            'level'     : LEVEL_NAMES.get(rec.get('level', INFO), '?'),
+            'file'      : self._getFilename(rec['file']) if rec.get('file') else '?',
+            'line'      : rec.get('line', 0),
+            'function'  : rec.get('function', '?'),
+            'message'   : s
+        }
+        if rec.get('exc'):
+            r['exception'] = rec['exc']
 
-        # Print the string
-        print(sctx + ls + ectx + beg + s + end + endl)
-        sys.stdout.flush()
+        if callable(fmt):
+            r['prefix'] = ls
+            return fmt(r)
 
-        # Write to log file if needed
-        if self.logfile:
-            try:
-                with open(self.logfile, "a") as f:
-                    f.write(ls + s + self.endl + endl)
-                    f.close()
-            except Exception as e:
-                pass
+        return encodeLogRecord(r, fmt)
 
     ''' Log function
         @param [in] args    - Log message arguments to format
     '''
     def __call__(self, *args):
-        self._Log(2, *args)
+        if INFO >= self.minlevel:
+            self._Log(2, *args)
+
+    ''' Log at debug level
+        @param [in] args    - Log message arguments to format
+    '''
+    def debug(self, *args):
+        if DEBUG >= self.minlevel:
+            self._Log(2, *args, level=DEBUG)
+
+    ''' Log at info level
+        @param [in] args    - Log message arguments to format
+    '''
+    def info(self, *args):
+        if INFO >= self.minlevel:
+            self._Log(2, *args, level=INFO)
+
+    ''' Log at warning level
+        @param [in] args    - Log message arguments to format
+    '''
+    def warn(self, *args):
+        if WARN >= self.minlevel:
+            self._Log(2, *args, level=WARN)
+
+    ''' Log at error level
+        @param [in] args    - Log message arguments to format
+    '''
+    def error(self, *args):
+        if ERROR >= self.minlevel:
+            self._Log(2, *args, level=ERROR)
 
     ''' Output status string
 
@@ -261,9 +2186,132 @@ class Logging:
         @param [in] s   - String to output
         @param [in] mx  - Output string length
     '''
-    def showStatus(s, mx=70):
-        print("\r" + s.ljust(mx, ' '), end='')
-        sys.stdout.flush()
+    def showStatus(self, s, mx=70):
+        with self.lock:
+            sys.stdout.write("\r" + s.ljust(mx, ' '))
+            sys.stdout.flush()
+
+class AsyncLogging:
+
+    ''' Constructor
+
+        Logging for asyncio code.  Records are queued and written by a
+        background thread, so the event loop never waits on the terminal
+        or disk.  The queue belongs to this object, plain log() calls stay
+        synchronous unless Logging.setAsync() is enabled, in which case
+        both share the logger's queue.  Every Logging object has one as
+        its aio member.
+
+        @param [in] log         - Logging object to write through
+        @param [in] queuesize   - Maximum number of queued records
+        @param [in] overflow    - What to do when the queue is full,
+                                  see Logging.setAsync()
+
+        Example:
+        @begincode
+
+            async def handler():
+                sparen.log.aio("Handling request")
+                await sparen.log.aio.drain()
+
+        @endcode
+    '''
+    def __init__(self, log, queuesize=10000, overflow='drop_oldest'):
+        if overflow not in ('block', 'drop_newest', 'drop_oldest'):
+            raise ValueError("Invalid overflow policy: %s" % overflow)
+        self.log = log
+        self.queuesize = queuesize
+        self.overflow = overflow
+        self.queue = None
+        self.writer = None
+        self.dropped = 0
+        self.qlock = threading.Lock()
+
+    ''' Queues a finished record, starting the writer on first use
+        @param [in] rec     - Log record
+    '''
+    def _dispatch(self, rec):
+
+        # The logger is already asynchronous, keep a single queue
+        if self.log.queue:
+            self.log._enqueue(rec)
+            return
+
+        if not self.queue:
+            with self.qlock:
+                if not self.queue:
+                    q = queue.Queue(maxsize=self.queuesize)
+                    self.writer = threading.Thread(target=self.log._writerThread, args=(q,), daemon=True)
+                    self.writer.start()
+                    self.queue = q
+            self.log._registerAtExit()
+
+        self.dropped += _queuePut(self.queue, rec, self.overflow)
+
+    ''' Waits until all queued records are written
+    '''
+    def _join(self):
+        q = self.queue
+        if q and threading.current_thread() is not self.writer:
+            q.join()
+
+    ''' Drains the queue and stops the writer
+    '''
+    def _stop(self):
+        with self.qlock:
+            q = self.queue
+            self.queue = None
+        if q:
+            q.put(None)
+            self.writer.join()
+            self.writer = None
+
+    ''' Returns the number of records dropped because the queue was full
+    '''
+    def getDropped(self):
+        return self.dropped
+
+    ''' Waits until all queued records are written without blocking the loop
+    '''
+    async def drain(self):
+        if self.queue or self.log.queue:
+            await asyncio.get_running_loop().run_in_executor(None, self.log.flush)
+
+    ''' Log function
+        @param [in] args    - Log message arguments to format
+    '''
+    def __call__(self, *args):
+        if INFO >= self.log.minlevel:
+            self.log._Log(2, *args, dispatch=self._dispatch)
+
+    ''' Log at debug level
+        @param [in] args    - Log message arguments to format
+    '''
+    def debug(self, *args):
+        if DEBUG >= self.log.minlevel:
+            self.log._Log(2, *args, level=DEBUG, dispatch=self._dispatch)
+
+    ''' Log at info level
+        @param [in] args    - Log message arguments to format
+    '''
+    def info(self, *args):
+        if INFO >= self.log.minlevel:
+            self.log._Log(2, *args, level=INFO, dispatch=self._dispatch)
+
+    ''' Log at warning level
+        @param [in] args    - Log message arguments to format
+    '''
+    def warn(self, *args):
+        if WARN >= self.log.minlevel:
+            self.log._Log(2, *args, level=WARN, dispatch=self._dispatch)
+
+    ''' Log at error level
+        @param [in] args    - Log message arguments to format
+    '''
+    def error(self, *args):
+        if ERROR >= self.log.minlevel:
+            self.log._Log(2, *args, level=ERROR, dispatch=self._dispatch)
+
 
 ''' Global logging object
 '''
@@ -271,37 +2319,35 @@ log = Logging()
 Log = log
 
 
-''' Plots an array
-    @param [in] a       - Array data to plot
-    @param [in] fn      - Optional function for retrieving data elements
+''' Sends the global logger's records to a collecting process
+
+    Pool initializer for any start method, a bound log.setCollector
+    would have to pickle the logger and its locks under spawn.
+
+    @param [in] q           - Queue from startCollector() in the
+                              collecting process
+    @param [in] batchsize   - Records to send at once
+'''
+def setCollector(q, batchsize=1):
+    log.setCollector(q, batchsize)
+
+
+''' Plots values into a character grid one point at a time
+    @param [in] v       - Values
+    @param [in] w       - Grid width
+    @param [in] h       - Grid height
     @param [in] scalex  - True to scale values to the x axis
-    @param [in] scaley  - True to scale values to the y axis
-    @param [in] height  - Height of the output plot
-    @param [in] width   - Width of the output plot
     @param [in] plot    - Character to use to plot the data
     @param [in] miny    - Minimum Y axis value
-    @param [in] maxy    - Maximum Y axis value
-    @param [in] marginy - Y axis top and bottom margin
+    @param [in] rg      - Y axis range
+
+    @returns List of rows, each a list of characters
 '''
-def plotArray(a, fn = None, scalex = True, scaley = True, height = 12, width = 70,
-              plot='.', miny = 0, maxy = 100, marginy = 1):
+def _plotGrid(v, w, h, scalex, plot, miny, rg):
 
-    w = width
-    h = height
     m = [[" " for x in range(0, w)] for y in range(0, h)]
 
-    # Get values
-    l = len(a)
-    v = a if not fn else [fn(x) for x in a]
-
-    # Are we scaling the y axis?
-    if scaley:
-        miny = min(v) - marginy
-        maxy = max(v) + marginy
-    rg = maxy - miny
-    if 0 == rg:
-        rg = 1
-
+    l = len(v)
     x = 0
     xa = 0
     i = 0
@@ -334,6 +2380,185 @@ def plotArray(a, fn = None, scalex = True, scaley = True, height = 12, width = 7
         # Plot character
         m[h - y - 1][x] = pt
 
+    return m
+
+''' Plots a NumPy array into a character grid, see _plotGrid()
+
+    Gives the same grid as _plotGrid(), the x column of point i is
+    (i * step) // len(v), exactly what the incremental division reaches
+
+    @returns List of row strings
+'''
+def _plotGridNumpy(v, w, h, scalex, plot, miny, rg):
+
+    l = len(v)
+
+    # Columns, points past the last column are dropped
+    x = (np.arange(l, dtype=np.int64) * (w if scalex else l)) // max(l, 1)
+    n = int(np.searchsorted(x, w))
+    x = x[:n]
+
+    # Rows, truncated toward zero like int()
+    y = np.trunc((v[:n] - miny) * h / rg)
+    pt = np.full(n, 1, dtype=np.int8)
+    pt[y < 0] = 2
+    pt[y >= h] = 3
+    y = np.clip(y, 0, h - 1).astype(np.int64)
+
+    # Later points overwrite earlier ones in the same cell
+    cell = (h - y - 1) * w + x
+    last = np.full(w * h, -1, dtype=np.int64)
+    np.maximum.at(last, cell, np.arange(n, dtype=np.int64))
+
+    chars = np.array([' ', plot, '_', '^'])
+    idx = np.zeros(w * h, dtype=np.int8)
+    hit = 0 <= last
+    idx[hit] = pt[last[hit]]
+    return [''.join(r) for r in chars[idx].reshape(h, w).tolist()]
+
+''' Reduces values to per column envelopes
+    @param [in] v       - Values, more than w
+    @param [in] w       - Number of columns
+    @param [in] vec     - True if v is a NumPy array
+    @param [in] avg     - True to calculate the means
+
+    @returns (lo, hi, mean) lists with one entry per column, mean is
+             None unless avg is set
+'''
+def _plotColumns(v, w, vec, avg):
+
+    l = len(v)
+
+    # Column c holds the points whose x is c, see _plotGridNumpy()
+    starts = [(c * l + w - 1) // w for c in range(0, w + 1)]
+
+    if vec:
+        idx = np.array(starts[:-1], dtype=np.int64)
+        lo = np.minimum.reduceat(v, idx)
+        hi = np.maximum.reduceat(v, idx)
+        mean = (np.add.reduceat(v, idx, dtype=np.float64) / np.diff(starts)).tolist() if avg else None
+        return lo.tolist(), hi.tolist(), mean
+
+    lo = []
+    hi = []
+    mean = [] if avg else None
+    for c in range(0, w):
+        seg = v[starts[c]:starts[c+1]]
+        lo.append(min(seg))
+        hi.append(max(seg))
+        if avg:
+            mean.append(sum(seg) / len(seg))
+    return lo, hi, mean
+
+''' Draws the vertical range of each column into a character grid
+    @param [in] lo      - Column minimums
+    @param [in] hi      - Column maximums
+    @param [in] mean    - Column means, None to skip
+    @param [in] h       - Grid height
+    @param [in] plot    - Character to use to plot the range
+    @param [in] plotmean - Character to use to plot the mean
+    @param [in] miny    - Minimum Y axis value
+    @param [in] rg      - Y axis range
+
+    @returns List of rows, each a list of characters
+'''
+def _plotRanges(lo, hi, mean, h, plot, plotmean, miny, rg):
+
+    w = len(lo)
+    m = [[" " for x in range(0, w)] for y in range(0, h)]
+
+    for x in range(0, w):
+
+        y0 = int((lo[x]-miny) * h / rg)
+        y1 = int((hi[x]-miny) * h / rg)
+        for y in range(min(max(y0, 0), h - 1), min(max(y1, 0), h - 1) + 1):
+            m[h - y - 1][x] = plot
+
+        if mean:
+            y = min(max(int((mean[x]-miny) * h / rg), 0), h - 1)
+            m[h - y - 1][x] = plotmean
+
+        # Out of range markers
+        if y0 < 0:
+            m[h - 1][x] = '_'
+        if y1 >= h:
+            m[0][x] = '^'
+
+    return m
+
+''' Plots an array
+
+    NumPy arrays are plotted with vectorized operations, lists and
+    arrays read through fn are plotted one point at a time.  With
+    decimate, inputs wider than the plot are reduced to one min/max
+    range per column first, so spikes stay visible and only the
+    reduction touches every point.
+
+    @param [in] a       - Array data to plot
+    @param [in] fn      - Optional function for retrieving data elements
+    @param [in] scalex  - True to scale values to the x axis
+    @param [in] scaley  - True to scale values to the y axis
+    @param [in] height  - Height of the output plot
+    @param [in] width   - Width of the output plot
+    @param [in] plot    - Character to use to plot the data
+    @param [in] miny    - Minimum Y axis value
+    @param [in] maxy    - Maximum Y axis value
+    @param [in] marginy - Y axis top and bottom margin
+    @param [in] decimate - Reduce large inputs to column ranges
+                            None        = Plot every point
+                            'minmax'    = Draw each column's min to max range
+                            'mean'      = Also mark each column's mean
+    @param [in] plotmean - Character to use to plot the mean
+'''
+def plotArray(a, fn = None, scalex = True, scaley = True, height = 12, width = 70,
+              plot='.', miny = 0, maxy = 100, marginy = 1, decimate = None, plotmean = '+'):
+
+    if decimate not in (None, 'minmax', 'mean'):
+        raise ValueError("Invalid decimation: %s" % decimate)
+
+    w = width
+    h = height
+
+    # Get values
+    l = len(a)
+    vec = np and isinstance(a, np.ndarray) and not fn and 1 == a.ndim
+    v = a if not fn else [fn(x) for x in a]
+
+    # Reduce to column ranges
+    cols = None
+    if decimate and scalex and l > w:
+        cols = _plotColumns(v, w, vec, 'mean' == decimate)
+
+    # Are we scaling the y axis?
+    if scaley and l:
+        if cols:
+            miny = min(cols[0]) - marginy
+            maxy = max(cols[1]) + marginy
+        else:
+            miny = (v.min() if vec else min(v)) - marginy
+            maxy = (v.max() if vec else max(v)) + marginy
+    rg = maxy - miny
+    if 0 == rg:
+        rg = 1
+
+    if cols:
+        m = _plotRanges(cols[0], cols[1], cols[2], h, plot, plotmean, miny, rg)
+    elif vec:
+        m = _plotGridNumpy(v, w, h, scalex, plot, miny, rg)
+    else:
+        m = _plotGrid(v, w, h, scalex, plot, miny, rg)
+
+    return _plotText(m, w, h, miny, maxy, rg)
+
+''' Adds the y axis labels and x axis to a plot grid
+    @param [in] m       - Grid rows
+    @param [in] w       - Grid width
+    @param [in] h       - Grid height
+    @param [in] miny    - Minimum Y axis value
+    @param [in] maxy    - Maximum Y axis value
+    @param [in] rg      - Y axis range
+'''
+def _plotText(m, w, h, miny, maxy, rg):
 
     # How wide is the y gutter
     j = max([len(str(int(miny))), len(str(int(maxy)))])
@@ -355,6 +2580,166 @@ def plotArray(a, fn = None, scalex = True, scaley = True, height = 12, width = 7
 
     return ret
 
+
+class StreamingPlot:
+
+    ''' Constructor
+
+        Plots values as they arrive.  Each column keeps only the min, max,
+        sum and count of its samples, so memory and rendering depend on
+        the plot size, never on the number of samples.
+
+        @param [in] width   - Width of the output plot
+        @param [in] height  - Height of the output plot
+        @param [in] per     - Samples per column to start with
+        @param [in] scroll  - What happens when the plot is full
+                                False   = Merge column pairs and double
+                                          the samples per column, the
+                                          plot always covers every sample
+                                True    = Drop the oldest column
+        @param [in] scaley  - True to scale the y axis to the data
+        @param [in] miny    - Minimum Y axis value
+        @param [in] maxy    - Maximum Y axis value
+        @param [in] marginy - Y axis top and bottom margin
+        @param [in] plot    - Character to use to plot the data
+        @param [in] mean    - True to mark each column's mean
+        @param [in] plotmean - Character to use to plot the mean
+    '''
+    def __init__(self, width=70, height=12, per=1, scroll=False, scaley=True, miny=0, maxy=100, marginy=1,
+                 plot='.', mean=False, plotmean='+'):
+        self.width = width
+        self.height = height
+        self.scroll = scroll
+        self.scaley = scaley
+        self.miny = miny
+        self.maxy = maxy
+        self.marginy = marginy
+        self.plot = plot
+        self.mean = mean
+        self.plotmean = plotmean
+        self.per = max(1, per)
+        self.clear()
+
+    ''' Cast object to string
+    '''
+    def __repr__(self):
+        return self.toString()
+
+    ''' Discards all samples
+    '''
+    def clear(self):
+        self.lo = []
+        self.hi = []
+        self.sum = []
+        self.n = []
+        self.count = 0
+
+    ''' Returns the number of samples added
+    '''
+    def getCount(self):
+        return self.count
+
+    ''' Returns the number of samples in each full column
+    '''
+    def getPerColumn(self):
+        return self.per
+
+    ''' Adds a sample
+        @param [in] v   - Sample value
+    '''
+    def push(self, v):
+        self.count += 1
+        if self.n and self.n[-1] < self.per:
+            if v < self.lo[-1]:
+                self.lo[-1] = v
+            if v > self.hi[-1]:
+                self.hi[-1] = v
+            self.sum[-1] += v
+            self.n[-1] += 1
+            return
+        self._addColumn([v])
+
+    ''' Adds samples from any iterable, read one column at a time
+        @param [in] it  - Iterable of sample values
+    '''
+    def extend(self, it):
+        it = iter(it)
+        while True:
+            room = self.per - self.n[-1] if self.n else 0
+            seg = list(itertools.islice(it, room if room else self.per))
+            if not seg:
+                break
+            self.count += len(seg)
+            if room:
+                self._fillColumn(seg)
+            else:
+                self._addColumn(seg)
+
+    ''' Adds samples to the last column
+        @param [in] seg - Samples, no more than the column has room for
+    '''
+    def _fillColumn(self, seg):
+        self.lo[-1] = min(self.lo[-1], min(seg))
+        self.hi[-1] = max(self.hi[-1], max(seg))
+        self.sum[-1] += sum(seg)
+        self.n[-1] += len(seg)
+
+    ''' Starts a new column, making room first if the plot is full
+        @param [in] seg - Samples for the column, no more than the
+                          samples per column
+    '''
+    def _addColumn(self, seg):
+        if len(self.n) >= self.width:
+            if self.scroll:
+                for c in (self.lo, self.hi, self.sum, self.n):
+                    del c[0]
+            else:
+                self._mergeColumns()
+
+                # An unpaired last column keeps its old count, fill it
+                # up before starting a new one
+                if self.n[-1] < self.per:
+                    self._fillColumn(seg)
+                    return
+
+        self.lo.append(min(seg))
+        self.hi.append(max(seg))
+        self.sum.append(sum(seg))
+        self.n.append(len(seg))
+
+    ''' Merges column pairs and doubles the samples per column
+    '''
+    def _mergeColumns(self):
+        r = range(0, len(self.n), 2)
+        self.lo = [min(self.lo[i:i+2]) for i in r]
+        self.hi = [max(self.hi[i:i+2]) for i in r]
+        self.sum = [sum(self.sum[i:i+2]) for i in r]
+        self.n = [sum(self.n[i:i+2]) for i in r]
+        self.per *= 2
+
+    ''' Returns the plot as a string
+    '''
+    def toString(self):
+        w = self.width
+        h = self.height
+
+        miny = self.miny
+        maxy = self.maxy
+        if self.scaley and self.n:
+            miny = min(self.lo) - self.marginy
+            maxy = max(self.hi) + self.marginy
+        rg = maxy - miny
+        if 0 == rg:
+            rg = 1
+
+        pad = w - len(self.n)
+        mean = [self.sum[i] / self.n[i] for i in range(0, len(self.n))] if self.mean else None
+        m = _plotRanges(self.lo, self.hi, mean, h, self.plot, self.plotmean, miny, rg)
+        for r in m:
+            r.extend([' '] * pad)
+
+        return _plotText(m, w, h, miny, maxy, rg)
+
 ''' Returns a string listing object attributes and their type
     @param [in] o   - Object to iterate
 '''
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 from __future__ import print_function
+import sys
+import time
 import math
+from array import array
 
 try:
     import sparen
@@ -9,14 +12,34 @@ try:
 except:
     Log = print
 
+# Optional, used for the 'numpy' canvas storage
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Code point buffers decode in one step
+CODEPOINT_CODEC = 'utf-32-le' if 'little' == sys.byteorder else 'utf-32-be'
+
 class Canvas:
 
     ''' Constructor
         @param [in] width   - Width of the canvas
         @param [in] height  - Height of the canvas
         @param [in] charset - Index of active characterset
+        @param [in] storage - How the cells are stored
+                                'list'  = List of one character strings
+                                'array' = array('I') of code points
+                                'numpy' = NumPy uint32 array of code points
+                              The code point buffers use 4 bytes per cell
+                              and render with a single decode.
     '''
-    def __init__(self, width=70, height=15, charset=0):
+    def __init__(self, width=70, height=15, charset=0, storage='list'):
+        if storage not in ('list', 'array', 'numpy'):
+            raise ValueError("Invalid canvas storage: %s" % storage)
+        if 'numpy' == storage and not np:
+            raise ValueError("numpy is not available")
+        self.storage = storage
         self.sErr = ""
         self.charsets = [
             {'lines': '-|.|--+|xx----', 'plot': '.', 'fill': '#'},
@@ -41,9 +64,16 @@ class Canvas:
     ''' Returns a string representation of the canvas
     '''
     def toString(self):
-        if 0 < self.nSize:
+        if 0 >= self.nSize:
+            return ''
+        if 'list' == self.storage:
             return ''.join(self.buf)
-        return ''
+        return self.buf.tobytes().decode(CODEPOINT_CODEC)
+
+    ''' Returns the cell storage type, see Canvas()
+    '''
+    def getStorage(self):
+        return self.storage
 
     ''' Returns a description of the last error
     '''
@@ -108,9 +138,16 @@ class Canvas:
         self.nHeight = height
         self.nSize = self.nWidth * self.nHeight + self.nHeight
 
-        self.buf = [' '] * self.nSize
-        for i in range(0, self.nHeight):
-            self.buf[i + (i+1) * self.nWidth] = '\n'
+        if 'list' == self.storage:
+            self.buf = [' '] * self.nSize
+            for i in range(0, self.nHeight):
+                self.buf[i + (i+1) * self.nWidth] = '\n'
+        else:
+            row = [ord(' ')] * self.nWidth + [ord('\n')]
+            if 'numpy' == self.storage:
+                self.buf = np.array(row * self.nHeight, dtype=np.uint32)
+            else:
+                self.buf = array('I', row) * self.nHeight
 
         return True
 
@@ -122,7 +159,9 @@ class Canvas:
     def getPoint(self, x, y):
         if 0 > x or self.nWidth <= x or 0 > y or self.nHeight <= y:
             return None
-        return self.buf[y * (self.nWidth + 1) + x]
+        if 'list' == self.storage:
+            return self.buf[y * (self.nWidth + 1) + x]
+        return chr(self.buf[y * (self.nWidth + 1) + x])
 
 
     ''' Sets a single point on the canvas
@@ -135,7 +174,7 @@ class Canvas:
             ch = self.charset['plot']
         if 0 > x or self.nWidth <= x or 0 > y or self.nHeight <= y:
             return False
-        self.buf[y * (self.nWidth + 1) + x] = ch
+        self.buf[y * (self.nWidth + 1) + x] = ch if 'list' == self.storage else ord(ch)
         return True
 
     ''' Substitute character based on a translation mapping
@@ -261,9 +300,27 @@ class Canvas:
         if y1 > y2:
             y1,y2 = y2,y1
 
+        # Clip and fill a row slice at a time
+        x1 = max(x1, 0)
+        y1 = max(y1, 0)
+        x2 = min(x2, self.nWidth)
+        y2 = min(y2, self.nHeight)
+        if x1 >= x2 or y1 >= y2:
+            return
+
+        if 'numpy' == self.storage:
+            self.buf.reshape(self.nHeight, self.nWidth + 1)[y1:y2, x1:x2] = ord(ch)
+            return
+
+        n = x2 - x1
+        if 'list' == self.storage:
+            fill = [ch] * n
+        else:
+            fill = array('I', [ord(ch)]) * n
+
         for y in range(y1, y2):
-            for x in range(x1, x2):
-                self.setPoint(x, y, ch)
+            i = y * (self.nWidth + 1) + x1
+            self.buf[i:i+n] = fill
 
 
     ''' Fills the entire canvas with the specified character
@@ -478,3 +535,160 @@ class Canvas:
             y1 += 1
 
 
+class Dashboard:
+
+    ''' Constructor
+
+        Redraws a canvas in place.  The first frame is printed in full,
+        after that only the cells that changed are written, using cursor
+        movement escape codes.  Frames are limited to the specified rate.
+        Anything else printed while live moves the frame, call reset()
+        afterwards so the next frame is printed in full.
+
+        @param [in] canvas  - Canvas to display
+        @param [in] fps     - Maximum frames per second, zero for no limit
+        @param [in] stream  - Output stream, None for the current sys.stdout
+        @param [in] live    - True to redraw in place, False to print each
+                              frame in full, None to redraw in place only
+                              if the stream is a terminal
+
+        Example:
+        @begincode
+
+            canv = sparen.Canvas(width=80, height=25)
+            dash = sparen.Dashboard(canv, fps=10)
+            while running:
+                canv.erase()
+                canv.text(2, 2, "Requests: %d" % count)
+                dash.update()
+            dash.close()
+
+        @endcode
+    '''
+    def __init__(self, canvas, fps=10, stream=None, live=None):
+        self.canvas = canvas
+        self.fps = fps
+        self.stream = stream
+        self.live = live
+        self.prev = None
+        self.last = 0
+        self.frames = 0
+        self.written = 0
+
+    ''' Returns the output stream
+    '''
+    def getStream(self):
+        return self.stream if self.stream else sys.stdout
+
+    ''' Returns True if frames are redrawn in place
+    '''
+    def isLive(self):
+        if self.live is not None:
+            return self.live
+        try:
+            return self.getStream().isatty()
+        except Exception as e:
+            return False
+
+    ''' Draws the canvas if it changed and the frame rate allows
+        @param [in] force   - True to draw whatever the frame rate
+
+        @returns True if a frame was drawn
+    '''
+    def update(self, force=False):
+
+        now = time.time()
+        if not force and self.fps and now - self.last < 1.0 / self.fps:
+            return False
+        self.last = now
+
+        rows = self.canvas.toString().split('\n')[:self.canvas.getHeight()]
+        out = self.render(rows)
+        if out:
+            self._write(out)
+            self.frames += 1
+        return True
+
+    ''' Returns the output needed to go from the previous frame to rows
+        @param [in] rows    - Row strings of the new frame
+    '''
+    def render(self, rows):
+
+        prev = self.prev
+        self.prev = rows
+
+        # First frame, a new size, or not a terminal
+        if not prev or len(prev) != len(rows) or not self.isLive():
+            self.prev = rows if self.isLive() else None
+            return '\n'.join(rows) + '\n'
+
+        h = len(rows)
+        out = []
+        cy = h
+        for y in range(0, h):
+
+            r = rows[y]
+            p = prev[y]
+            if r == p:
+                continue
+
+            # Move to the row, the cursor starts below the frame
+            out.append('\x1b[%dA' % (cy - y) if cy > y else '\x1b[%dB' % (y - cy))
+            cy = y
+
+            if len(r) != len(p):
+                out.append('\r\x1b[K' + r)
+                continue
+
+            # Runs of changed cells, short gaps are rewritten rather
+            # than skipped with another escape code
+            runs = []
+            x = 0
+            w = len(r)
+            while x < w:
+                if r[x] == p[x]:
+                    x += 1
+                    continue
+                s = x
+                while x < w and r[x] != p[x]:
+                    x += 1
+                if runs and s - runs[-1][1] <= 4:
+                    runs[-1] = (runs[-1][0], x)
+                else:
+                    runs.append((s, x))
+
+            for s, e in runs:
+                out.append('\x1b[%dG%s' % (s + 1, r[s:e]))
+
+        if not out:
+            return ''
+
+        # Back below the frame
+        out.append('\x1b[%dB\r' % (h - cy))
+        return ''.join(out)
+
+    ''' Writes to the stream, holding the log lock so lines do not interleave
+        @param [in] out - String to write
+    '''
+    def _write(self, out):
+        lock = getattr(Log, 'lock', None)
+        f = self.getStream()
+        if lock:
+            with lock:
+                f.write(out)
+                f.flush()
+        else:
+            f.write(out)
+            f.flush()
+        self.written += len(out)
+
+    ''' Forgets the previous frame so the next one is printed in full
+    '''
+    def reset(self):
+        self.prev = None
+
+    ''' Draws any pending changes and stops redrawing in place
+    '''
+    def close(self):
+        self.update(force=True)
+        self.prev = None
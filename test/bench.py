@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import inspect
+import asyncio
+import argparse
+import tempfile
+import traceback
+import multiprocessing
+
+import sparen
+Log = sparen.log
+
+
+''' Times a function
+    @param [in] fn      - Function to time
+    @param [in] count   - Number of times to call the function
+
+    @returns Average time per call in seconds
+'''
+def timeit(fn, count):
+    t = time.perf_counter()
+    for i in range(0, count):
+        fn()
+    return (time.perf_counter() - t) / count
+
+
+''' Runs a function with stdout redirected to the null device
+    @param [in] fn      - Function to run
+'''
+def quiet(fn):
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as f:
+        sys.stdout = f
+        try:
+            return fn()
+        finally:
+            sys.stdout = stdout
+
+
+''' Reports a single benchmark result
+    @param [in] name    - Benchmark name
+    @param [in] t       - Average time per call in seconds
+'''
+def report(name, t):
+    Log("%s %10.3f us/call" % (name.ljust(40, ' '), t * 1000000))
+
+
+''' Calls a function at the specified stack depth
+    @param [in] depth   - Stack depth
+    @param [in] fn      - Function to call
+'''
+def nest(depth, fn):
+    if 0 >= depth:
+        return fn()
+    return nest(depth - 1, fn)
+
+
+def bench_caller(count, depth):
+
+    def old():
+        return inspect.getframeinfo(inspect.stack()[1][0])
+
+    def new():
+        return Log._getCaller(1)
+
+    report("caller: inspect.stack() depth=%d" % depth, nest(depth, lambda: timeit(old, count)))
+    report("caller: _getCaller() depth=%d" % depth, nest(depth, lambda: timeit(new, count)))
+    report("log() depth=%d" % depth, quiet(lambda: nest(depth, lambda: timeit(lambda: Log("Hello world!"), count))))
+
+
+def bench_filename(count):
+
+    full = os.path.abspath(__file__)
+
+    def uncached():
+        Log.fncache = {}
+        return Log._getFilename(full)
+
+    def cached():
+        return Log._getFilename(full)
+
+    report("filename: uncached", timeit(uncached, count))
+    report("filename: cached", timeit(cached, count))
+
+
+def bench_async(count):
+
+    log = sparen.Logging()
+
+    def run():
+        return timeit(lambda: log("Hello world!"), count)
+
+    report("log() sync", quiet(run))
+
+    def runasync():
+        t = run()
+        log.setAsync(False)
+        return t
+
+    log.setAsync(True, queuesize=count)
+    report("log() async, caller side", quiet(runasync))
+
+
+def bench_filters(count):
+
+    log = sparen.Logging()
+    s = "Just a regular line of log output that matches nothing"
+    ls = "[10:06:37] ./bench.py(147): "
+
+    def old():
+        beg = ''
+        for k,v in log.console_color_filters.items():
+            if 0 <= s.lower().find(k.lower()) or 0 <= ls.lower().find(k.lower()):
+                for c in v:
+                    c = c.upper()
+                    if 'BLOCK' == c:
+                        return
+                    elif c in log.console_colors:
+                        beg += log.console_colors[c]
+        return beg
+
+    def new():
+        return log._matchFilters(s, ls)
+
+    for n in (1, 10, 100):
+        log.clearLogFilters()
+        log.addLogFilters(','.join(["filter%d:red:bold" % i for i in range(0, n)]))
+        report("filters: loop, %d filters" % n, timeit(old, count))
+        report("filters: compiled, %d filters" % n, timeit(new, count))
+
+
+def bench_timestamp(count):
+
+    import datetime
+
+    for tmpl in ('%H:%M:%S', '%H:%M:%S.%3f'):
+        log = sparen.Logging(tstmpl=tmpl)
+        rec = {'t': time.time()}
+        report("timestamp: strftime '%s'" % tmpl, timeit(lambda: datetime.datetime.fromtimestamp(rec['t']).strftime(tmpl), count))
+        report("timestamp: cached '%s'" % tmpl, timeit(lambda: log._formatTimestamp(rec), count))
+
+
+def bench_level(count):
+
+    log = sparen.Logging(level=sparen.INFO)
+    report("log.debug() disabled", timeit(lambda: log.debug("Value", sparen.Lazy("%d", 1)), count))
+    report("log.info() enabled", quiet(lambda: timeit(lambda: log.info("Value", sparen.Lazy("%d", 1)), count)))
+
+
+def bench_exception(count, depth):
+
+    def fail():
+        raise ValueError("Downstream failed")
+
+    try:
+        nest(depth, fail)
+    except Exception as ex:
+        e = ex
+
+    def old():
+        tb = traceback.TracebackException.from_exception(e)
+        st = str(e) + os.linesep
+        for d in range(len(tb.stack)-1, -1, -1):
+            st += " > %s(%s)::%s() %s%s" % (os.path.basename(str(tb.stack[d][0])), tb.stack[d][1], tb.stack[d][2], tb.stack[d][3], os.linesep)
+        return "[EXCEPTION] " + st
+
+    def new():
+        return Log._formatException(e)
+
+    report("exception: TracebackException depth=%d" % depth, timeit(old, count))
+    report("exception: _formatException depth=%d" % depth, timeit(new, count))
+
+
+def bench_flush(count):
+
+    log = sparen.Logging()
+
+    report("log() flush every line", quiet(lambda: timeit(lambda: log("Hello world!"), count)))
+
+    log.setFlushPolicy(lines=1000)
+    report("log() flush every 1000 lines", quiet(lambda: timeit(lambda: log("Hello world!"), count)))
+    quiet(log.flush)
+
+
+def mp_direct(args):
+    fname, lines = args
+    for i in range(0, lines):
+        with open(fname, 'a') as f:
+            f.write("[00:00:00] ./bench.py(1): Hello world! %d%s" % (i, os.linesep))
+    return lines
+
+
+def mp_collector(lines):
+    for i in range(0, lines):
+        Log("Hello world!", i)
+    Log.flush()
+    return lines
+
+
+def bench_multiprocess(workers, lines):
+
+    with tempfile.TemporaryDirectory() as d:
+
+        fname = os.path.join(d, 'bench.log')
+
+        t = time.perf_counter()
+        with multiprocessing.Pool(workers) as pool:
+            pool.map(mp_direct, [(fname, lines)] * workers)
+        report("multiprocess: open per line %dx%d" % (workers, lines), (time.perf_counter() - t) / (workers * lines))
+
+        def run():
+            Log.setLogFile(fname)
+            t = time.perf_counter()
+            q = Log.startCollector()
+            with multiprocessing.Pool(workers, initializer=sparen.setCollector, initargs=(q, 100)) as pool:
+                pool.map(mp_collector, [lines] * workers)
+            Log.stopCollector()
+            Log.setLogFile('')
+            return (time.perf_counter() - t) / (workers * lines)
+
+        report("multiprocess: collector, batch 100 %dx%d" % (workers, lines), quiet(run))
+
+
+class SlowSink(sparen.LogSink):
+
+    ''' Constructor
+
+        Stands in for a slow terminal or disk, each write sleeps
+
+        @param [in] delay   - Seconds per write
+    '''
+    def __init__(self, delay):
+        super().__init__(context=False)
+        self.delay = delay
+
+    def write(self, out):
+        time.sleep(self.delay)
+
+
+def bench_asyncio(count):
+
+    async def lag(stop, lags):
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            t = loop.time()
+            await asyncio.sleep(0.001)
+            lags.append(loop.time() - t - 0.001)
+
+    async def run(fn, drain):
+        stop = asyncio.Event()
+        lags = []
+        ticker = asyncio.create_task(lag(stop, lags))
+        for i in range(0, count):
+            fn("Hello world!", i)
+            if 0 == i % 100:
+                await asyncio.sleep(0)
+        await drain()
+        stop.set()
+        await ticker
+        return lags
+
+    async def nodrain():
+        pass
+
+    for name, delay in (('devnull', 0), ('slow 50us', 0.00005)):
+
+        log = sparen.Logging()
+        log.removeSink(log.getSinks()[0])
+        log.addSink(SlowSink(delay) if delay else sparen.NullSink())
+
+        for fn, drain in (('log()', nodrain), ('log.aio()', log.aio.drain)):
+            call = log if 'log()' == fn else log.aio
+            t = time.perf_counter()
+            lags = asyncio.run(run(call, drain))
+            t = time.perf_counter() - t
+            Log("event loop lag, %s %s: max %.3f ms, mean %.3f ms, total %.0f ms"
+                % (name.ljust(10, ' '), fn.ljust(10, ' '), max(lags) * 1000, sum(lags) / len(lags) * 1000, t * 1000))
+
+
+def bench_ring(count):
+
+    log = sparen.Logging(level=sparen.INFO)
+    log.setRingBuffer(1000)
+    report("log.debug() into ring buffer", timeit(lambda: log.debug("Value", 1), count))
+
+
+def bench_sinks(count):
+
+    with tempfile.TemporaryDirectory() as d:
+
+        log = sparen.Logging()
+        log.setLogFile(os.path.join(d, 'bench.log'))
+        report("log() console + text file", quiet(lambda: timeit(lambda: log("Hello world!"), count)))
+
+        for i in range(0, 3):
+            log.addSink(sparen.FileSink(os.path.join(d, 'bench%d.log' % i)))
+        report("log() console + 4 text files", quiet(lambda: timeit(lambda: log("Hello world!"), count)))
+
+        log.addSink(sparen.MemorySink(1000, fmt='json'))
+        report("log() console + 4 text files + json", quiet(lambda: timeit(lambda: log("Hello world!"), count)))
+
+        for sink in log.getSinks()[1:]:
+            log.removeSink(sink)
+
+
+def bench_compress(count):
+
+    with tempfile.TemporaryDirectory() as d:
+
+        for name, sink in (('text', lambda fn: sparen.FileSink(fn)),
+                           ('gzip 1', lambda fn: sparen.CompressedFileSink(fn, compresslevel=1)),
+                           ('gzip 6', lambda fn: sparen.CompressedFileSink(fn, compresslevel=6)),
+                           ('xz 1', lambda fn: sparen.CompressedFileSink(fn, codec='xz', compresslevel=1))):
+
+            fname = os.path.join(d, name.replace(' ', ''))
+            log = sparen.Logging()
+            log.removeSink(log.getSinks()[0])
+            sk = sink(fname)
+            log.addSink(sk)
+
+            t = timeit(lambda: log("Request handled in", 42, "ms, status", 200), count)
+            log.removeSink(sk)
+            report("file sink %s, %d bytes" % (name, os.path.getsize(fname)), t)
+
+
+def bench_plot():
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    for n in (1000, 100000, 10000000):
+        a = rng.normal(size=n)
+        l = a.tolist()
+        report("plotArray() list, %d points" % n, timeit(lambda: sparen.plotArray(l), 1))
+        report("plotArray() numpy, %d points" % n, timeit(lambda: sparen.plotArray(a), 1))
+        report("plotArray() list, minmax, %d points" % n, timeit(lambda: sparen.plotArray(l, decimate='minmax'), 1))
+        report("plotArray() numpy, minmax, %d points" % n, timeit(lambda: sparen.plotArray(a, decimate='minmax'), 1))
+
+
+def bench_streaming(count):
+
+    sp = sparen.StreamingPlot()
+    report("StreamingPlot.push()", timeit(lambda: sp.push(1.5), count))
+
+    sp = sparen.StreamingPlot()
+    report("StreamingPlot.extend(), per sample", timeit(lambda: sp.extend(range(0, 1000)), int(count / 10)) / 1000)
+    report("StreamingPlot.toString()", timeit(sp.toString, int(count / 10)))
+
+
+def bench_dashboard(count):
+
+    import io
+
+    canv = sparen.Canvas(width=80, height=25, charset=2)
+
+    def run(live):
+        f = io.StringIO()
+        dash = sparen.Dashboard(canv, fps=0, stream=f, live=live)
+        t = time.perf_counter()
+        for i in range(0, count):
+            canv.erase()
+            canv.rect(0, 0, 79, 24)
+            canv.text(2, 2, "Requests: %d" % (i * 37))
+            canv.line(2, 12, 2 + i % 70, 12 + i % 10)
+            dash.update()
+        return (time.perf_counter() - t) / count, dash.written / count
+
+    for live in (False, True):
+        t, n = run(live)
+        report("dashboard %s frame, %.0f bytes" % ('diff' if live else 'full', n), t)
+
+
+def bench_canvas(count):
+
+    import tracemalloc
+
+    for storage in ('list', 'array', 'numpy'):
+
+        tracemalloc.start()
+        canv = sparen.Canvas(width=1000, height=500, charset=2, storage=storage)
+        for y in range(0, 500, 2):
+            canv.line(0, y, 999, y)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        report("canvas %s 1000x500, %d bytes, toString()" % (storage, size), timeit(canv.toString, count))
+        report("canvas %s setPoint()" % storage, timeit(lambda: canv.setPoint(10, 10, '*'), count * 10))
+        report("canvas %s erase()" % storage, timeit(canv.erase, count))
+
+
+def main():
+
+    ap = argparse.ArgumentParser(description='Benchmarks')
+    ap.add_argument('--count', '-c', default=10000, type=int, help='Iterations per benchmark')
+    ap.add_argument('--depth', '-d', default=50, type=int, help='Stack depth')
+    ap.add_argument('--workers', '-w', default=8, type=int, help='Worker processes')
+    ap.add_argument('--lines', '-l', default=0, type=int, help='Lines per worker, defaults to count')
+    _p = vars(ap.parse_args())
+
+    bench_caller(_p['count'], _p['depth'])
+    bench_filename(_p['count'])
+    bench_async(_p['count'])
+    bench_filters(_p['count'])
+    bench_timestamp(_p['count'])
+    bench_level(_p['count'])
+    bench_exception(int(_p['count'] / 10), _p['depth'])
+    bench_flush(_p['count'])
+    bench_ring(_p['count'])
+    bench_sinks(_p['count'])
+    bench_compress(_p['count'])
+    bench_plot()
+    bench_streaming(_p['count'])
+    bench_dashboard(int(_p['count'] / 10))
+    bench_canvas(int(_p['count'] / 100))
+    bench_asyncio(_p['count'])
+    bench_multiprocess(_p['workers'], _p['lines'] if _p['lines'] else _p['count'])
+
+
+if __name__ == '__main__':
+    main()
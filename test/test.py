@@ -1,7 +1,17 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import io
+import re
+import time
 import json
+import asyncio
 import argparse
+import datetime
+import threading
+import multiprocessing
+import tempfile
 import numpy as np
 
 import sparen
@@ -180,6 +190,874 @@ def test_5():
     assert ts == "25.001200"
 
 
+''' Runs a function against a logger writing to a temporary log file
+    @param [in] fn      - Function taking the Logging object, called
+                          with the file open
+    @param [in] log     - Logging object, None for a new one
+    @param [in] filekw  - Extra setLogFile() arguments
+    @param [in] kwargs  - Logging() arguments for a new logger
+
+    @returns Lines written to the file, without line endings
+'''
+def log_to_file(fn, log=None, filekw=None, **kwargs):
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, 'test.log')
+        if not log:
+            log = sparen.Logging(**kwargs)
+        log.setLogFile(fname, **(filekw or {}))
+        fn(log)
+        log.close()
+        with open(fname) as f:
+            return [l.rstrip('\n') for l in f.readlines()]
+
+
+def test_6():
+
+    def run(log):
+        for i in range(0, 100):
+            log("Line %d" % i)
+        log.flush()
+
+        fname = log.logfile
+        assert os.path.exists(fname + '.1')
+        assert os.path.exists(fname + '.2')
+        assert not os.path.exists(fname + '.3')
+        assert 1000 >= os.path.getsize(fname)
+
+    lines = log_to_file(run, filekw={'maxsize': 1000, 'backups': 2})
+    assert lines[-1].endswith("Line 99")
+
+    # Multi-byte text still rotates on the size in bytes
+    def run(log):
+        for i in range(0, 100):
+            log("Zeile %d \u00fc\u00f6\u00e4 \u2713\u2713\u2713" % i)
+        log.flush()
+
+        fname = log.logfile
+        for f in (fname, fname + '.1', fname + '.2'):
+            assert 1000 >= os.path.getsize(f)
+
+    lines = log_to_file(run, filekw={'maxsize': 1000, 'backups': 2})
+    assert lines[-1].endswith("Zeile 99 \u00fc\u00f6\u00e4 \u2713\u2713\u2713")
+
+
+def test_7():
+
+    def run(log):
+        log.setAsync(True, queuesize=1000, overflow='block')
+        for i in range(0, 500):
+            log("Async %d" % i)
+        log.setAsync(False)
+
+    lines = log_to_file(run)
+    assert 500 == len(lines)
+    assert lines[0].endswith("Async 0")
+    assert lines[-1].endswith("Async 499")
+
+
+def test_8():
+
+    t = 1643068800.25
+
+    log = sparen.Logging(tstmpl='%Y-%m-%d %H:%M:%S.%3f')
+    ts = log._formatTimestamp({'t': t})
+    Log(ts)
+    assert ts == datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.250')
+
+    ts = log._formatTimestamp({'t': t + 1.5})
+    assert ts == datetime.datetime.fromtimestamp(t + 1).strftime('%Y-%m-%d %H:%M:%S.750')
+
+    log.setTimestamp('$+H:$M:$S.$F', relative=True)
+    ts = log._formatTimestamp({'t': t, 'mt': log.mstart + 3723.5})
+    Log(ts)
+    assert ts == "01:02:03.500"
+
+
+def test_9():
+
+    calls = []
+    def expensive():
+        calls.append(1)
+        return 'expensive'
+
+    def run(log):
+        log.debug('hidden', sparen.Lazy(expensive))
+        log.info('shown', sparen.Lazy('%d items', 3))
+        log.setLevel('debug')
+        log.debug('now shown', sparen.Lazy(expensive))
+
+    lines = log_to_file(run, linetmpl='<<level>>: ', level=sparen.INFO)
+    assert 1 == len(calls)
+    assert lines == ["INFO: shown 3 items", "DEBUG: now shown expensive"]
+
+
+def test_10():
+
+    def noisy(log):
+        log("from noisy")
+
+    def run(log):
+        log.setColor(False)
+        log.addLogFilters("secret:block,function=noisy:block,error:red")
+        log("nothing secret here")
+        log("Error: kept")
+        for i in range(0, 3):
+            noisy(log)
+
+    log = sparen.Logging()
+    lines = log_to_file(run, log)
+    assert 1 == len(lines)
+    assert lines[0].endswith("Error: kept")
+    assert log.getBlockCounts() == {'secret': 1, 'function=noisy': 3}
+
+    # File names match the caller as they did the line prefix
+    log = sparen.Logging()
+    mem = sparen.MemorySink(10)
+    log.addSink(mem)
+    log.addLogFilters("test.py:block")
+    log("from this file")
+    assert [] == mem.getLines()
+    assert log.getBlockCounts() == {'test.py': 1}
+
+
+def test_11():
+
+    def run(log):
+        log.setRateLimit(3, 0.2)
+        for i in range(0, 101):
+            if 100 == i:
+                time.sleep(0.25)
+            log("Error: downstream failed", i)
+
+        # A flood that stops is summarized once its window ends
+        for i in range(0, 10):
+            log("Warning: retrying", i)
+        time.sleep(0.25)
+        log("Done")
+
+        # Or on flush
+        for i in range(0, 5):
+            log("Polling", i)
+        log.flush()
+
+    log = sparen.Logging()
+    lines = [l.split(': ', 1)[1] for l in log_to_file(run, log)]
+    assert 106 == log.getRateLimited()
+    assert lines == ["Error: downstream failed 0", "Error: downstream failed 1", "Error: downstream failed 2",
+                     "[97 repeated lines suppressed] Error: downstream failed 99", "Error: downstream failed 100",
+                     "Warning: retrying 0", "Warning: retrying 1", "Warning: retrying 2",
+                     "[7 repeated lines suppressed] Warning: retrying 9", "Done",
+                     "Polling 0", "Polling 1", "Polling 2", "[2 repeated lines suppressed] Polling 4"]
+
+    # Threads sharing a call site share its count
+    def run(log):
+        log.setRateLimit(5, 60)
+
+        def flood():
+            for i in range(0, 500):
+                log("Flood")
+
+        threads = [threading.Thread(target=flood) for i in range(0, 8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        log.flush()
+
+    log = sparen.Logging()
+    lines = [l.split(': ', 1)[1] for l in log_to_file(run, log)]
+    assert 3995 == log.getRateLimited()
+    assert lines == ["Flood"] * 5 + ["[3995 repeated lines suppressed] Flood"]
+
+
+def worker_12(n):
+    for i in range(0, 200):
+        Log("worker %d line %d" % (n, i))
+    return n
+
+
+def test_12():
+
+    def run(log):
+        q = log.startCollector()
+        with multiprocessing.Pool(4, initializer=sparen.setCollector, initargs=(q,)) as pool:
+            assert [0, 1, 2, 3] == pool.map(worker_12, range(0, 4))
+        log.stopCollector()
+
+    lines = log_to_file(run, Log)
+    assert 800 == len(lines)
+    for n in range(0, 4):
+        mine = [l for l in lines if ": worker %d line " % n in l]
+        assert [l.split(': ', 1)[1] for l in mine] == ["worker %d line %d" % (n, i) for i in range(0, 200)]
+
+
+def test_12_spawn():
+
+    # Spawned workers import a fresh sparen and configure its global logger
+    def run(log):
+        ctx = multiprocessing.get_context('spawn')
+        q = log.startCollector(ctx)
+        with ctx.Pool(2, initializer=sparen.setCollector, initargs=(q, 10)) as pool:
+            assert [0, 1] == pool.map_async(worker_12_flush, range(0, 2)).get(timeout=30)
+        log.stopCollector()
+
+    lines = log_to_file(run, Log)
+    assert 400 == len(lines)
+
+
+def worker_12_flush(n):
+    worker_12(n)
+    Log.flush()
+    return n
+
+
+def test_12_async():
+
+    # Forked workers inherit the async queue but not its writer thread
+    def run(log):
+        log.setAsync(True)
+        ctx = multiprocessing.get_context('fork')
+        q = log.startCollector(ctx)
+        with ctx.Pool(4, initializer=sparen.setCollector, initargs=(q,)) as pool:
+            assert [0, 1, 2, 3] == pool.map_async(worker_12_flush, range(0, 4)).get(timeout=10)
+        log.stopCollector()
+        log.setAsync(False)
+
+    lines = log_to_file(run, Log)
+    assert 800 == len(lines)
+
+
+def test_13():
+
+    def worker(log, n):
+        for i in range(0, 200):
+            log("thread %d line %d" % (n, i) + " padding" * 20)
+            if 0 == i % 50:
+                log.addLogFilter("thread %d line %d:red" % (n, i))
+
+    def run(log):
+        threads = [threading.Thread(target=worker, args=(log, n), name="T%d" % n) for n in range(0, 32)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+    t = time.perf_counter()
+    lines = log_to_file(run, linetmpl='<<thread>>: ')
+    t = time.perf_counter() - t
+
+    Log("32 threads, %d lines/s" % int(len(lines) / t))
+
+    assert 32 * 200 == len(lines)
+    for n in range(0, 32):
+        mine = [l for l in lines if l.startswith("T%d: " % n)]
+        assert mine == ["T%d: thread %d line %d" % (n, n, i) + " padding" * 20 for i in range(0, 200)]
+
+
+def test_14():
+
+    async def handler(log, n):
+        for i in range(0, 10):
+            log.aio("request %d step %d" % (n, i))
+            await asyncio.sleep(0)
+        await log.aio.drain()
+
+    async def handlers(log):
+        await asyncio.gather(*[asyncio.create_task(handler(log, n), name="req%d" % n) for n in range(0, 5)])
+
+    def run(log):
+        asyncio.run(handlers(log))
+
+        # Plain calls stay synchronous
+        mem = sparen.MemorySink(10)
+        log.addSink(mem)
+        for i in range(0, 1000):
+            log("sync", i)
+            assert mem.getLines()[-1].endswith("sync %d\n" % i)
+        assert log.queue is None and 0 == log.getDropped() and 0 == log.aio.getDropped()
+
+    lines = log_to_file(run, linetmpl='<<task>>: ')
+    assert 50 == len([l for l in lines if l.startswith("req")])
+    for n in range(0, 5):
+        assert ["req%d: request %d step %d" % (n, n, i) for i in range(0, 10)] == [l for l in lines if l.startswith("req%d:" % n)]
+
+
+def test_15():
+
+    with tempfile.TemporaryDirectory() as d:
+
+        for fmt in ('json', 'binary'):
+
+            fname = os.path.join(d, 'test.' + fmt)
+
+            log = sparen.Logging(reldir='-')
+            log.setLogFile(fname, fmt=fmt)
+            log.warn("Structured", 1)
+            try:
+                fun1()
+            except Exception as e:
+                log.error("Failed\n", e)
+            log.close()
+
+            recs = list(sparen.readLogRecords(fname, fmt))
+            assert 2 == len(recs)
+
+            assert 'WARN' == recs[0]['level']
+            assert 'Structured 1' == recs[0]['message']
+            assert 'test.py' == recs[0]['file']
+            assert 'test_15' == recs[0]['function']
+            assert 'exception' not in recs[0]
+
+            assert 'ERROR' == recs[1]['level']
+            assert 1 == len(recs[1]['exception'])
+            assert 'NameError' == recs[1]['exception'][0]['type']
+            assert ['fun2', 'fun1', 'test_15'] == [f['function'] for f in recs[1]['exception'][0]['frames']]
+            assert recs[0]['ts'] <= recs[1]['ts']
+
+
+def test_16():
+
+    def run(log):
+        log.setRingBuffer(5)
+        for i in range(0, 20):
+            log.debug("step", i)
+        log("info line")
+        log.error("failed")
+        log.debug("after")
+        try:
+            fun1()
+        except Exception as e:
+            log("caught", e)
+
+    lines = log_to_file(run, linetmpl='<<level>>: ', level=sparen.INFO)
+    assert lines[:8] == ["INFO: info line"] + ["DEBUG: step %d" % i for i in range(15, 20)] + ["ERROR: failed", "DEBUG: after"]
+    assert lines[8].startswith("INFO: caught [EXCEPTION]")
+
+
+def test_17():
+
+    with tempfile.TemporaryDirectory() as d:
+
+        fname = os.path.join(d, 'errors.jsonl')
+
+        log = sparen.Logging(linetmpl='<<level>>: ', level=sparen.DEBUG)
+        null = sparen.NullSink()
+        log.removeSink(log.getSinks()[0])
+        log.addSink(null)
+
+        mem = sparen.MemorySink(3)
+        err = sparen.FileSink(fname, level=sparen.ERROR, fmt='json')
+        log.addSink(mem)
+        log.addSink(err)
+        log.addSink(sparen.MemorySink(3, fmt=lambda r: r['prefix'] + r['message'].upper()))
+
+        for i in range(0, 5):
+            log.debug("line", i)
+        log.error("failed")
+        log.removeSink(err)
+
+        recs = list(sparen.readLogRecords(fname, 'json'))
+
+    assert mem.getLines() == ["DEBUG: line 3\n", "DEBUG: line 4\n", "ERROR: failed\n"]
+    assert log.getSinks()[-1].getLines()[-1] == "ERROR: FAILED"
+    assert 1 == len(recs) and "failed" == recs[0]['message'] and "ERROR" == recs[0]['level']
+    assert [null, mem] == log.getSinks()[:2]
+
+
+def test_18():
+
+    with tempfile.TemporaryDirectory() as d:
+
+        fname = os.path.join(d, 'test.log.gz')
+        xname = os.path.join(d, 'test.jsonl.xz')
+
+        log = sparen.Logging(linetmpl='<<level>>: ', level=sparen.DEBUG)
+        log.removeSink(log.getSinks()[0])
+        log.addSink(sparen.CompressedFileSink(fname, maxsize=512, backups=100, interval=0.000001, compresslevel=1))
+        log.addSink(sparen.CompressedFileSink(xname, fmt='json', codec='xz'))
+
+        for i in range(0, 2000):
+            log("line", i)
+
+        # Readable while still open once flushed
+        log.flush()
+        live = list(sparen.readLogRecords(xname, 'json'))
+
+        for sink in log.getSinks():
+            log.removeSink(sink)
+
+        segs = sparen.getLogSegments(fname)
+        lines = [l.strip() for l in sparen.readLogLines(fname, segments=True)]
+        recs = list(sparen.readLogRecords(xname, 'json'))
+
+    assert 1 < len(segs)
+    assert lines == ["INFO: line %d" % i for i in range(0, 2000)]
+    assert 2000 == len(live) and 2000 == len(recs) and "line 1999" == recs[-1]['message']
+
+    # A bad codec raises without the destructor complaining
+    errors = []
+    hook = sys.unraisablehook
+    sys.unraisablehook = errors.append
+    try:
+        try:
+            sparen.CompressedLogFile(fname, codec='zip')
+            assert False
+        except ValueError:
+            pass
+    finally:
+        sys.unraisablehook = hook
+    assert [] == errors
+
+    # Error lines and async batches leave blocks to the sink's interval
+    with tempfile.TemporaryDirectory() as d:
+        log = sparen.Logging()
+        log.removeSink(log.getSinks()[0])
+        sink = sparen.CompressedFileSink(os.path.join(d, 'test.log.gz'), interval=60)
+        log.addSink(sink)
+        log.error("first")
+        t = sink.f.flushed
+        log.setAsync(True)
+        for i in range(0, 100):
+            log.error("line", i)
+        log.queue.join()
+        assert t == sink.f.flushed
+        log.setAsync(False)
+        log.flush()
+        assert t < sink.f.flushed
+        log.removeSink(sink)
+
+
+def test_19():
+
+    rng = np.random.default_rng(19)
+    for a in (np.sin(np.linspace(-np.pi * 3, np.pi * 3, 200)) * 10, rng.integers(-50, 50, 1234), rng.normal(size=7)):
+        for scalex in (True, False):
+            assert sparen.plotArray(a, scalex=scalex) == sparen.plotArray(list(a), scalex=scalex)
+            assert sparen.plotArray(a, scaley=False, miny=-5, maxy=5) == sparen.plotArray(list(a), scaley=False, miny=-5, maxy=5)
+
+    Log('PLOT\r\n', sparen.plotArray(rng.normal(size=100000)))
+
+
+def test_20():
+
+    a = np.zeros(100000)
+    a[54321] = 100
+    a[12345] = -100
+
+    for d in ('minmax', 'mean'):
+        p = sparen.plotArray(a, decimate=d)
+        assert p == sparen.plotArray(a.tolist(), decimate=d)
+        rows = [r.split(' : ', 1)[1] for r in p.split('\n')[:12]]
+        assert '.' == rows[0][int(54321 * 70 / 100000)] and '.' == rows[-1][int(12345 * 70 / 100000)]
+
+    # Small inputs are not decimated
+    assert sparen.plotArray(a[:50], decimate='mean') == sparen.plotArray(a[:50])
+
+    Log('PLOT\r\n', sparen.plotArray(np.random.default_rng(20).normal(size=100000), decimate='mean'))
+
+
+def test_21():
+
+    a = np.random.default_rng(21).normal(size=10000)
+    a[1234] = 50
+
+    # Filled one sample at a time or from a generator gives the same plot
+    sp1 = sparen.StreamingPlot(width=70, mean=True)
+    sp2 = sparen.StreamingPlot(width=70, mean=True)
+    for v in a:
+        sp1.push(v)
+    sp2.extend(v for v in a)
+    assert sp1.toString() == sp2.toString()
+    assert 10000 == sp1.getCount() and 70 >= len(sp1.n) and 10000 == sum(sp1.n)
+    assert 50 == max(sp1.hi)
+
+    # Matches plotArray() while every sample has its own column
+    sp = sparen.StreamingPlot(width=70)
+    sp.extend(a[:70])
+    assert sp.toString() == sparen.plotArray(a[:70])
+
+    # Every full column holds the same number of samples, odd widths included
+    for width in (5, 75):
+        sp1 = sparen.StreamingPlot(width=width)
+        sp2 = sparen.StreamingPlot(width=width)
+        sp1.extend(range(0, 1000))
+        for v in range(0, 1000):
+            sp2.push(v)
+        for sp in (sp1, sp2):
+            assert [sp.getPerColumn()] * (len(sp.n) - 1) == sp.n[:-1]
+            assert sp.n[-1] <= sp.getPerColumn() and 1000 == sum(sp.n) and width >= len(sp.n)
+
+    # Scrolling keeps the most recent samples
+    sp = sparen.StreamingPlot(width=10, per=10, scroll=True)
+    sp.extend(range(0, 1000))
+    assert 10 == sp.getPerColumn() and 900 == sp.lo[0] and 999 == sp.hi[-1]
+
+    Log('PLOT\r\n', sp1)
+
+
+''' Applies cursor movement escape codes to a list of screen rows
+    @param [in] screen  - Screen rows, updated in place
+    @param [in] out     - Terminal output
+    @param [in] pos     - Cursor (row, column)
+
+    @returns New cursor position
+'''
+def apply_ansi(screen, out, pos):
+    r, c = pos
+    i = 0
+    while i < len(out):
+        m = re.match(r'\x1b\[(\d*)([ABGK])', out[i:])
+        if m:
+            n = int(m.group(1) or 1)
+            if 'A' == m.group(2):
+                r -= n
+            elif 'B' == m.group(2):
+                r += n
+            elif 'G' == m.group(2):
+                c = n - 1
+            else:
+                screen[r] = screen[r][:c]
+            i += m.end()
+            continue
+        ch = out[i]
+        i += 1
+        if '\n' == ch:
+            r += 1
+            c = 0
+        elif '\r' == ch:
+            c = 0
+        else:
+            while len(screen) <= r:
+                screen.append('')
+            row = screen[r].ljust(c + 1)
+            screen[r] = row[:c] + ch + row[c+1:]
+            c += 1
+    return (r, c)
+
+
+def test_22():
+
+    canv = sparen.Canvas(width=40, height=10, charset=2)
+    f = io.StringIO()
+    dash = sparen.Dashboard(canv, fps=0, stream=f, live=True)
+
+    screen = []
+    pos = (0, 0)
+    for i in range(0, 50):
+        canv.erase()
+        canv.rect(0, 0, 39, 9)
+        canv.text(2, 2, "count %d" % (i * 37))
+        canv.line(3, 5, 3 + (i * 7) % 30, 5 + i % 4)
+        f.seek(0)
+        f.truncate()
+        dash.update()
+        pos = apply_ansi(screen, f.getvalue(), pos)
+        assert [r.ljust(40) for r in screen] == canv.toString().split('\n')[:10]
+        assert (10, 0) == pos
+
+    # Only the changes were written
+    assert dash.written < 50 * 410 / 3
+
+    # Frame rate cap
+    dash = sparen.Dashboard(canv, fps=1, stream=f, live=True)
+    assert dash.update() and not dash.update() and dash.update(force=True)
+
+    # Not a terminal, every frame is printed in full
+    f = io.StringIO()
+    dash = sparen.Dashboard(canv, fps=0, stream=f)
+    dash.update()
+    dash.update()
+    assert f.getvalue() == canv.toString() * 2
+
+
+def test_23():
+
+    out = []
+    for storage in ('list', 'array', 'numpy'):
+
+        canv = sparen.Canvas(width=80, height=25, charset=2, storage=storage)
+        assert storage == canv.getStorage()
+
+        canv.line(2, 2, 40, 2)
+        canv.rect(4, 4, 20, 10)
+        canv.line(5, 5, 19, 9)
+        canv.fillRect(25, 6, 45, 14)
+        canv.fillRect(70, 20, 90, 30, '#')
+        canv.circle(60, 6, 5)
+        canv.arc(60, 6, 5, 0, 180, '*')
+        canv.rect(10, 15, 50, 23)
+        canv.textBox(11, 15, 49, 23, 'Some text that has to wrap over a few rows of the box')
+
+        assert '╔' == canv.getPoint(4, 4) and '#' == canv.getPoint(79, 24) and None == canv.getPoint(80, 0)
+        out.append(canv.toString())
+
+    assert out[0] == out[1] == out[2]
+
+    # Rectangles entirely off the canvas draw nothing
+    for storage in ('list', 'array', 'numpy'):
+        canv = sparen.Canvas(width=8, height=4, storage=storage)
+        canv.fillRect(2, -5, 6, -1, '#')
+        canv.fillRect(-6, 1, -2, 3, '#')
+        canv.fillRect(2, 5, 6, 9, '#')
+        assert '#' not in canv.toString()
+
+    canv = sparen.Canvas(width=1000, height=500, storage='array')
+    canv.erase('.')
+    assert 500 * 1001 == len(canv.toString())
+
+
+def test_24():
+
+    env = {k: os.environ.pop(k) for k in ('NO_COLOR', 'FORCE_COLOR') if k in os.environ}
+    stdout = sys.stdout
+    try:
+        sys.stdout = io.StringIO()
+        log = sparen.Logging()
+
+        # Not a terminal
+        assert not log.usecolor and '' == log.sctx
+
+        os.environ['FORCE_COLOR'] = '1'
+        log.refreshColor()
+        assert log.usecolor and log.sctx
+
+        os.environ['FORCE_COLOR'] = '0'
+        log.refreshColor()
+        assert not log.usecolor
+
+        # NO_COLOR wins over FORCE_COLOR
+        os.environ['FORCE_COLOR'] = '1'
+        os.environ['NO_COLOR'] = '1'
+        log.refreshColor()
+        assert not log.usecolor
+
+        # setColor() overrides the environment
+        log.setColor(True)
+        assert log.usecolor and log.ectx
+        del os.environ['NO_COLOR']
+        log.setColor(False)
+        assert not log.usecolor and '' == log.ectx
+
+    finally:
+        sys.stdout = stdout
+        for k in ('NO_COLOR', 'FORCE_COLOR'):
+            os.environ.pop(k, None)
+        os.environ.update(env)
+
+
+def test_25():
+
+    def caller(st):
+        raise AssertionError("caller looked up")
+
+    log = sparen.Logging(linetmpl='<<pid>> <<elapsed>> <<x>> <<level>>: ')
+    log.removeSink(log.getSinks()[0])
+    mem = sparen.MemorySink(10)
+    log.addSink(mem)
+
+    # No caller fields, no caller lookup
+    log._getCaller = caller
+    log("hello")
+    assert not log.tmpl_caller
+
+    pid, elapsed, x, line = mem.getLines()[-1].split(' ', 3)
+    assert str(os.getpid()) == pid
+    assert re.match(r'^\d+:\d\d:\d\d\.\d+$', elapsed)
+    assert '<<x>>' == x and "INFO: hello\n" == line
+
+    # Caller fields bring the lookup back
+    del log._getCaller
+    log.setLineTemplate('<<function>>: ')
+    log("again")
+    assert log.tmpl_caller and "test_25: again\n" == mem.getLines()[-1]
+
+
+class SlowSink(sparen.MemorySink):
+
+    ''' Memory sink that takes a while to write each line
+    '''
+    def write(self, out):
+        time.sleep(0.0005)
+        super().write(out)
+
+
+def test_26():
+
+    # Every line is either written or counted as dropped
+    for overflow in ('drop_newest', 'drop_oldest'):
+        log = sparen.Logging()
+        log.removeSink(log.getSinks()[0])
+        mem = SlowSink(1000)
+        log.addSink(mem)
+        log.setAsync(True, queuesize=5, overflow=overflow)
+        for i in range(0, 100):
+            log("line", i)
+        log.setAsync(False)
+        assert 0 < log.getDropped()
+        assert 100 == len(mem.getLines()) + log.getDropped()
+        if 'drop_oldest' == overflow:
+            assert mem.getLines()[-1].endswith("line 99\n")
+
+    log = sparen.Logging()
+    log.removeSink(log.getSinks()[0])
+    mem = SlowSink(1000)
+    log.addSink(mem)
+    log.aio = sparen.AsyncLogging(log, queuesize=5)
+    for i in range(0, 100):
+        log.aio("line", i)
+    log.flush()
+    assert 0 < log.aio.getDropped()
+    assert 100 == len(mem.getLines()) + log.aio.getDropped()
+
+
+def test_27():
+
+    def run(log):
+        log.setAsync(True)
+        log("parent")
+        log.flush()
+        pid = os.fork()
+        if 0 == pid:
+            # Child, nothing drains the inherited queue
+            try:
+                log("child")
+                log.flush()
+                log.close()
+            finally:
+                os._exit(0)
+
+        t = time.time() + 10
+        while 0 == os.waitpid(pid, os.WNOHANG)[0]:
+            if time.time() > t:
+                os.kill(pid, 9)
+                assert False, "child hung in flush()"
+            time.sleep(0.01)
+        log.setAsync(False)
+
+    lines = log_to_file(run)
+    assert ["parent", "child"] == sorted([l.split(': ', 1)[1] for l in lines], reverse=True)
+
+
+def test_28():
+
+    with tempfile.TemporaryDirectory() as d:
+        other = os.path.join(d, 'other.log')
+
+        def run(log):
+            log.addSink(SlowSink())
+            log.setAsync(True, queuesize=1000, overflow='block')
+            for i in range(0, 200):
+                log("first %d" % i)
+            log.setLogFile(other)
+            for i in range(0, 200):
+                log("second %d" % i)
+            log.close()
+            log.setAsync(False)
+
+        lines = log_to_file(run)
+        assert 200 == len(lines) and all(' first ' in l for l in lines)
+        with open(other) as f:
+            lines = f.readlines()
+        assert 200 == len(lines) and all(' second ' in l for l in lines)
+
+
+class FlushCounter(io.StringIO):
+
+    ''' Stream that counts flushes
+    '''
+    flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+
+def test_29():
+
+    log = sparen.Logging()
+    log.removeSink(log.getSinks()[0])
+    stream = FlushCounter()
+    log.addSink(sparen.ConsoleSink(fmt='text', stream=stream))
+
+    # Line count and level
+    log.setFlushPolicy(lines=10, interval=0, level=sparen.ERROR)
+    for i in range(0, 25):
+        log("Line %d" % i)
+    assert 2 == stream.flushes
+    log.error("Failed")
+    assert 3 == stream.flushes
+
+    # Interval, pending lines are flushed without logging anything else
+    log.setFlushPolicy(lines=0, interval=0.05)
+    for i in range(0, 5):
+        log("Line %d" % i)
+    n = stream.flushes
+    t = time.time() + 5
+    while n == stream.flushes and time.time() < t:
+        time.sleep(0.01)
+    assert n + 1 == stream.flushes
+    time.sleep(0.2)
+    assert n + 1 == stream.flushes
+
+    log.setFlushPolicy()
+    assert 25 + 1 + 5 == len(stream.getvalue().splitlines())
+
+
+def test_30():
+
+    log = sparen.Logging()
+    log.setExceptionFormat(maxdepth=1)
+    nl = os.linesep
+
+    def wrap():
+        try:
+            fun1()
+        except NameError as e:
+            raise ValueError("wrapped") from e
+
+    try:
+        wrap()
+    except ValueError as e:
+        err = e
+
+    # Innermost frame first, the rest counted
+    raised = err.__traceback__.tb_next.tb_lineno
+    nogood = fun2.__code__.co_firstlineno + 1
+    assert log._formatException(err) == \
+        "[EXCEPTION] wrapped" + nl + \
+        " > test.py(%d)::wrap() raise ValueError(\"wrapped\") from e" % raised + nl + \
+        " > ... 1 more" + nl + \
+        "[CAUSED BY] name 'nogood' is not defined" + nl + \
+        " > test.py(%d)::fun2() something = nogood" % nogood + nl + \
+        " > ... 2 more" + nl
+
+    # Rendered frames are cached by code location
+    key = (fun2.__code__, nogood)
+    assert key in log.exccache
+    log.exccache[key] = " > cached" + nl
+    assert " > cached" in log._formatException(err).split(nl)
+
+    def handle(suppress):
+        try:
+            fun1()
+        except NameError:
+            if suppress:
+                raise KeyError("k") from None
+            raise KeyError("k")
+
+    def heads(suppress):
+        try:
+            handle(suppress)
+        except KeyError as e:
+            return [l for l in log._formatException(e).split(nl) if l.startswith('[')]
+
+    assert heads(False) == ["[EXCEPTION] 'k'", "[DURING HANDLING OF] name 'nogood' is not defined"]
+    assert heads(True) == ["[EXCEPTION] 'k'"]
+
+    log.setExceptionFormat(chain=False)
+    assert 1 == len([l for l in log._formatException(err).split(nl) if l.startswith('[')])
+
+
 def main():
 
     Log("sparen version: %s" % sparen.__version__)
@@ -202,6 +1080,33 @@ def main():
     test_3()
     test_4()
     test_5()
+    test_6()
+    test_7()
+    test_8()
+    test_9()
+    test_10()
+    test_11()
+    test_12()
+    test_12_async()
+    test_12_spawn()
+    test_13()
+    test_14()
+    test_15()
+    test_16()
+    test_17()
+    test_18()
+    test_19()
+    test_20()
+    test_21()
+    test_22()
+    test_23()
+    test_24()
+    test_25()
+    test_26()
+    test_27()
+    test_28()
+    test_29()
+    test_30()
 
 
 if __name__ == '__main__':